@@ -0,0 +1,239 @@
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Partition columns of every kind of archived table, besides the hour
+PARTITIONS = {'trades': ['product'], 'settlements': ['product'],
+              'balances': []}
+
+
+def hour_key(times):
+    """
+    Hour partition values, eg. 2018-03-01T13, of datetime64[ns] values.
+    """
+    return np.datetime_as_string(np.asarray(times, 'datetime64[h]'))
+
+
+class Archive(object):
+    """
+    Partitioned Parquet archive of trades, settlements and balances.
+
+    The add methods only put the tables on a queue, so the tick path never
+    waits on the disk. A writer thread batches the queued rows per
+    partition and writes them out every flush_interval seconds, or as soon
+    as a partition holds flush_rows rows, as new files in hive style
+    directories:
+
+        <path>/trades/product=BTC-USD/hour=2018-03-01T13/part-....parquet
+        <path>/settlements/product=BTC-USD/hour=.../part-....parquet
+        <path>/balances/hour=.../part-....parquet
+
+    Settlements and balances are stamped with the tick time in a time
+    column, trades keep their own trade time. Requires the pyarrow package.
+    """
+
+    def __init__(self, path, flush_rows=100000, flush_interval=5):
+        """
+        args:
+            path: directory of the archive, created if missing
+            flush_rows: rows of one partition that trigger a write
+            flush_interval: seconds between writes of the buffered rows
+        """
+        # Fail early rather than in the writer thread without pyarrow
+        import pyarrow.parquet
+
+        self.path = path
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+
+        self.queue = queue.Queue()
+        self.buffers = {}
+        self.n_written = 0
+        self.error = None
+        self._seq = itertools.count()
+
+        self.thread = threading.Thread(target=self._writer)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _put(self, kind, table, **keys):
+        if self.error is not None:
+            raise RuntimeError('Archive writer failed: %r' % self.error)
+        self.queue.put((kind, table, keys))
+
+    def add_trades(self, prod_id, trades):
+        """
+        Archive trades of a product, indexed by trade_id with time, price,
+        size and the assigned long and short parties.
+        """
+        if len(trades) > 0:
+            self._put('trades', trades.reset_index(), product=prod_id)
+
+    def add_settlements(self, prod_id, now, settlements):
+        """
+        Archive the settlements table of a product at tick time now.
+        """
+        table = settlements.reset_index()
+        table['time'] = np.datetime64(now, 'ns')
+        self._put('settlements', table, product=prod_id)
+
+    def add_balances(self, now, balances):
+        """
+        Archive the balances table at tick time now.
+        """
+        table = balances.reset_index()
+        table['time'] = np.datetime64(now, 'ns')
+        self._put('balances', table)
+
+    def _writer(self):
+        deadline = time.monotonic() + self.flush_interval
+
+        while True:
+            try:
+                item = self.queue.get(
+                    timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = False
+
+            try:
+                if item is None:
+                    self._flush()
+                    return
+
+                if item:
+                    self._buffer(*item)
+
+                if time.monotonic() >= deadline:
+                    self._flush()
+                    deadline = time.monotonic() + self.flush_interval
+
+            except Exception as e:
+                logger.exception('Archive writer failed.')
+                self.error = e
+                return
+
+    def _buffer(self, kind, table, keys):
+        """
+        Split a queued table by hour into the partition buffers.
+        """
+        hours = hour_key(table['time'].values)
+        unique = np.unique(hours)
+        for hour in unique:
+            part = table if len(unique) == 1 else table[hours == hour]
+            key = (kind, tuple(keys.get(k) for k in PARTITIONS[kind]), hour)
+            buffer = self.buffers.setdefault(key, [[], 0])
+            buffer[0].append(part)
+            buffer[1] += len(part)
+
+            if buffer[1] >= self.flush_rows:
+                self._write(key)
+
+    def _write(self, key):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        kind, values, hour = key
+        tables, n = self.buffers.pop(key)
+
+        directory = os.path.join(
+            self.path, kind,
+            *['%s=%s' % kv for kv in zip(PARTITIONS[kind], values)],
+            'hour=%s' % hour)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        name = 'part-%d-%d-%d.parquet' % (time.time_ns(), os.getpid(),
+                                          next(self._seq))
+        table = pa.Table.from_pandas(pd.concat(tables, ignore_index=True),
+                                     preserve_index=False)
+
+        # Write under a temporary name so readers never see a partial file
+        tmp = os.path.join(directory, '.' + name)
+        pq.write_table(table, tmp)
+        os.replace(tmp, os.path.join(directory, name))
+        self.n_written += n
+
+    def _flush(self):
+        for key in list(self.buffers):
+            self._write(key)
+
+    @property
+    def pending(self):
+        """
+        Number of tables queued but not yet buffered by the writer.
+        """
+        return self.queue.qsize()
+
+    def close(self):
+        """
+        Write out everything queued and stop the writer thread.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise RuntimeError('Archive writer failed: %r' % self.error)
+
+
+def read_archive(path, kind, start=None, end=None, products=None,
+                 columns=None):
+    """
+    Read archived rows of one kind within a time range.
+
+    The time range is pushed down to the hour partitions, so only the files
+    of the hours in range are opened, and to the Parquet row group
+    statistics of the time column within them.
+
+    args:
+        path: directory of the archive
+        kind: trades, settlements or balances
+        start: include rows at or after this time, None for no lower bound
+        end: include rows before this time, None for no upper bound
+        products: optional list of product IDs to read
+        columns: optional list of columns to read
+
+    return: DataFrame of the matching rows
+    """
+    import pyarrow.dataset as ds
+
+    directory = os.path.join(path, kind)
+    if not os.path.isdir(directory):
+        return pd.DataFrame()
+
+    dataset = ds.dataset(directory, format='parquet', partitioning='hive')
+
+    condition = None
+    for c in _time_range(start, end):
+        condition = c if condition is None else condition & c
+    if products is not None:
+        c = ds.field('product').isin(list(products))
+        condition = c if condition is None else condition & c
+
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+
+def _time_range(start, end):
+    """
+    Dataset filter expressions on hour partitions and time of a range.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    conditions = []
+    if start is not None:
+        start = np.datetime64(start, 'ns')
+        conditions.append(ds.field('hour') >= str(hour_key(start)))
+        conditions.append(ds.field('time') >= pa.scalar(start))
+    if end is not None:
+        end = np.datetime64(end, 'ns')
+        conditions.append(ds.field('hour') <= str(hour_key(end)))
+        conditions.append(ds.field('time') < pa.scalar(end))
+
+    return conditions
@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+
+
+class BalanceSheet(object):
+    """
+    Balances of all parties and their settlement obligations in all
+    products, as a dense float64 matrix of parties by products.
+
+    The obligations of a tick are staged product by product with set, and
+    commit applies them at once: the difference between the staged and the
+    previous obligations of the staged products is summed over products and
+    taken off the balance vector, in one vectorized operation. A product's
+    staged obligations replace its previous ones entirely, so a party that
+    no longer has a trade in the window owes nothing in it.
+
+    The matrix is kept in Fortran order, so the obligations of one product
+    are contiguous.
+    """
+
+    def __init__(self, n_parties=10, prod_ids=(), initial_balance=100000):
+        """
+        args:
+            n_parties: initial number of counter parties, grown on demand
+            prod_ids: initial product IDs, more are added on demand
+            initial_balance: balance of each party before any settlement
+        """
+        self.initial_balance = initial_balance
+        self.products = {}
+
+        self.balances = np.full(n_parties, float(initial_balance))
+        self.obligations = np.zeros((n_parties, 0), order='F')
+        self.staged = np.zeros((n_parties, 0), order='F')
+        self.dirty = np.zeros(0, dtype=bool)
+
+        for prod_id in prod_ids:
+            self._product(prod_id)
+
+    def _resize(self, n_parties, n_products):
+        """
+        Grow the matrices so party ids below n_parties and n_products fit.
+        """
+        rows, cols = self.obligations.shape
+        if n_parties <= rows and n_products <= cols:
+            return
+
+        shape = (max(rows, n_parties), max(cols, n_products))
+        for name in ['obligations', 'staged']:
+            grown = np.zeros(shape, order='F')
+            grown[:rows, :cols] = getattr(self, name)
+            setattr(self, name, grown)
+
+        self.balances = np.concatenate([
+            self.balances,
+            np.full(shape[0] - rows, float(self.initial_balance))])
+        self.dirty = np.concatenate([self.dirty,
+                                     np.zeros(shape[1] - cols, dtype=bool)])
+
+    def _product(self, prod_id):
+        """
+        Column of the product, adding it first if it is new.
+        """
+        if prod_id not in self.products:
+            # Grow the columns geometrically when many products come in
+            cols = self.obligations.shape[1]
+            if len(self.products) == cols:
+                self._resize(0, max(1, 2 * cols))
+            self.products[prod_id] = len(self.products)
+
+        return self.products[prod_id]
+
+    def set(self, prod_id, party, obligation):
+        """
+        Stage the settlement obligations of a product.
+
+        args:
+            prod_id: product ID, eg. BTC-USD, ETH-USD
+            party: int array of parties
+            obligation: settlement obligation of each party; parties not
+            given and NaN (zero net quantity) count as 0
+        """
+        j = self._product(prod_id)
+        party = np.asarray(party, dtype=np.int64)
+        self._resize(int(party.max(initial=-1)) + 1, 0)
+
+        column = self.staged[:, j]
+        if not self.dirty[j]:
+            column[:] = 0
+            self.dirty[j] = True
+        column[party] = np.nan_to_num(np.asarray(obligation,
+                                                 dtype=np.float64))
+
+    def commit(self):
+        """
+        Apply the staged obligations to the balances.
+
+        return: the balances of all parties
+        """
+        cols = np.flatnonzero(self.dirty)
+
+        if len(cols) == len(self.products):
+            # Every product staged: one difference over the whole matrix,
+            # written over the previous obligations, then the buffers swap
+            # roles
+            delta = np.subtract(self.staged, self.obligations,
+                                out=self.obligations)
+            self.balances -= delta.sum(axis=1)
+            self.obligations, self.staged = self.staged, self.obligations
+        elif len(cols) > 0:
+            self.balances -= (self.staged[:, cols] -
+                              self.obligations[:, cols]).sum(axis=1)
+            self.obligations[:, cols] = self.staged[:, cols]
+
+        self.dirty[:] = False
+
+        return self.balances
+
+    def frame(self):
+        """
+        The balances in the layout of the balances table of the main loop.
+        """
+        balances = pd.DataFrame({'party': range(len(self.balances)),
+                                 'initial_balance': self.initial_balance,
+                                 'current_balance': self.balances.copy()})
+
+        return balances.set_index('party')
@@ -0,0 +1,108 @@
+"""
+Benchmark of settlements over several horizons: one MultiWindowVWAP pass
+against one settlement_calculator call per window size, on a TradeStore
+of synthetic trades spanning the longest window.
+
+A tick is simulated before every timed run by appending a trade, so
+nothing computed for the previous tick can be reused:
+
+    python benchmarks/horizons.py
+    python benchmarks/horizons.py --trades 100000 1000000 --horizons 60 3600
+
+Run from the crypto_settlement directory.
+"""
+
+import argparse
+import datetime as dt
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from main import parties_assigner, settlement_calculator
+from netting import net_positions, settlement_table
+from settlement_engine import MultiWindowVWAP
+from settlement_path import synthetic_trades
+from trade_store import TradeStore
+
+
+def tick(store):
+    """
+    Append one trade a nanosecond after the newest one.
+    """
+    store.append([store.last_trade_id + 1],
+                 store.column('time')[-1:] + 1, store.column('price')[-1:],
+                 [0.01], [0], [1])
+
+
+def best_of(func, store, repeat):
+    """
+    Best wall time of func over repeat ticks, in seconds.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        tick(store)
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--trades', type=int, nargs='+',
+                        default=[10 ** 4, 10 ** 5, 10 ** 6],
+                        help='trades in the longest window')
+    parser.add_argument('--horizons', type=int, nargs='+',
+                        default=[60, 300, 3600],
+                        help='window sizes in seconds')
+    parser.add_argument('--parties', type=int, default=10,
+                        help='number of counter parties')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='timed ticks, the best is kept')
+    args = parser.parse_args()
+
+    prod_id = 'BTC-USD'
+    print('%9s %8s %12s %12s %8s' % ('trades', 'horizons', 'naive s',
+                                     'multi s', 'speedup'))
+    for n_trades in args.trades:
+        trades = synthetic_trades(n_trades, prod_id, span=max(args.horizons))
+        trades = parties_assigner(args.parties, trades,
+                                  rng=np.random.default_rng(0))
+        store = TradeStore(capacity=n_trades + args.repeat + 1)
+        store.append_frame(trades)
+        price = float(store.column('price')[-1])
+        multi = MultiWindowVWAP(prod_id, store, args.parties)
+
+        def naive():
+            return {w: settlement_calculator(store, prod_id, w,
+                                             current_price=price)
+                    for w in args.horizons}
+
+        def one_pass():
+            return multi.settlements(args.horizons, price)
+
+        # Both paths have to agree before they are compared, at one fixed
+        # end of window since the trades near a cutoff move with the clock
+        now = np.datetime64(dt.datetime.utcnow(), 'ns')
+        for w, table in multi.settlements(args.horizons, price, now).items():
+            window = store.window((now - np.timedelta64(w, 's'))
+                                  .astype(np.int64))
+            notional, quantity, n = net_positions(
+                window['long'], window['short'],
+                window['price'] * window['size'], window['size'])
+            party = np.flatnonzero(n)
+            pd.testing.assert_frame_equal(table, settlement_table(
+                prod_id, party, notional[party], quantity[party], price))
+
+        seconds_naive = best_of(naive, store, args.repeat)
+        seconds_multi = best_of(one_pass, store, args.repeat)
+        print('%9d %8d %12.5f %12.5f %7.1fx' % (
+            n_trades, len(args.horizons), seconds_naive, seconds_multi,
+            seconds_naive / seconds_multi))
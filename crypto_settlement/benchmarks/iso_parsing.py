@@ -0,0 +1,66 @@
+"""
+Microbenchmark of trade timestamp parsing: per-row iso_converter against the
+vectorized iso_parser.
+
+Run from the crypto_settlement directory:
+
+    python benchmarks/iso_parsing.py
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import iso_converter, iso_parser
+
+
+def timestamps(n, seed=0):
+    """
+    Generate GDAX style timestamps, one in ten without fractional seconds.
+
+    args:
+        n: number of timestamps
+        seed: random seed
+
+    return: a Series of strings in iso format
+    """
+    rng = np.random.default_rng(seed)
+    t = pd.Timestamp('2018-01-01') + \
+        pd.to_timedelta(np.sort(rng.integers(0, 86400 * 10 ** 6, n)), 'us')
+    s = pd.Series(t.strftime('%Y-%m-%dT%H:%M:%S.%fZ'))
+    s[::10] = s[::10].str[:19] + 'Z'
+
+    return s
+
+
+def best_of(func, s, repeat):
+    """
+    Best wall time of func(s) over repeat runs, in seconds.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(s)
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+if __name__ == '__main__':
+    print('%10s %12s %12s %9s' % ('rows', 'apply (s)', 'vector (s)',
+                                  'speedup'))
+
+    for n in [1000, 100000, 1000000]:
+        s = timestamps(n)
+        repeat = 5 if n < 1000000 else 1
+
+        per_row = best_of(lambda x: x.apply(iso_converter), s, repeat)
+        vector = best_of(iso_parser, s, repeat)
+
+        print('%10d %12.4f %12.4f %8.1fx' % (n, per_row, vector,
+                                             per_row / vector))
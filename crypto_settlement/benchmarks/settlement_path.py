@@ -0,0 +1,231 @@
+"""
+Scaling benchmark of the settlement path: parties_assigner,
+settlement_calculator, balance_calculator and a BalanceSheet update on
+synthetic trades, over a grid of trade, party and product counts.
+
+Wall time (best of a few runs) and peak traced memory of every function
+at every grid point are appended as JSON lines to the output file, tagged
+with the git revision, so runs of different versions can be compared:
+
+    python benchmarks/settlement_path.py
+    python benchmarks/settlement_path.py --trades 1000 100000 --parties 10 \\
+        --baseline benchmarks/settlement_path.jsonl
+
+Run from the crypto_settlement directory. Trades are split evenly over the
+products, so the product count shows the per-product overhead at a fixed
+total volume.
+"""
+
+import argparse
+import datetime as dt
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import parties_assigner, settlement_calculator, balance_calculator
+from balances import BalanceSheet
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def synthetic_trades(n_trades, prod_id='BTC-USD', span=1800, seed=0):
+    """
+    Generate a trades table shaped like the decoded trades endpoint: indexed
+    by trade_id in descending order, with time, price, size and side.
+
+    args:
+        n_trades: number of trades
+        prod_id: product id, only used to vary the random stream
+        span: seconds back from now covered by the trades
+        seed: random seed
+
+    return: trades table
+    """
+    rng = np.random.default_rng([seed, sum(map(ord, prod_id))])
+
+    now = np.datetime64(dt.datetime.utcnow(), 'ns')
+    offsets = np.sort(rng.integers(0, span * 10 ** 9, n_trades))
+    price = 100 * np.exp(np.cumsum(rng.normal(0, 1e-4, n_trades)))
+
+    trades = pd.DataFrame({
+        'time': now - offsets.astype('timedelta64[ns]'),
+        'price': price.round(2),
+        'size': rng.uniform(0.001, 2, n_trades).round(8),
+        'side': np.where(rng.random(n_trades) < 0.5, 'buy', 'sell')},
+        index=pd.Index(np.arange(n_trades, 0, -1), name='trade_id'))
+
+    return trades
+
+
+def measure(func, make_args, repeat):
+    """
+    Best wall time over repeat runs and peak traced memory of one more run.
+
+    args:
+        func: function to measure
+        make_args: returns fresh arguments of func for every run, outside of
+        the measurement
+        repeat: number of timed runs
+
+    return: seconds, peak bytes
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        args = make_args()
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+
+    args = make_args()
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return best, peak
+
+
+def run_point(n_trades, n_parties, n_products, repeat):
+    """
+    Measure the settlement path functions at one grid point, over all
+    products.
+
+    return: dict mapping function name to (seconds, peak bytes)
+    """
+    prod_ids = ['P%d-USD' % i for i in range(n_products)]
+    per_product = max(1, n_trades // n_products)
+
+    trades = {p: synthetic_trades(per_product, p) for p in prod_ids}
+    rng = np.random.default_rng(0)
+    assigned = {p: parties_assigner(n_parties, trades[p].copy(), rng=rng)
+                for p in prod_ids}
+    price = {p: float(trades[p]['price'].iloc[0]) for p in prod_ids}
+    settlements = {p: settlement_calculator(assigned[p], p,
+                                            current_price=price[p])
+                   for p in prod_ids}
+
+    def balances():
+        return pd.DataFrame({'party': range(n_parties),
+                             'initial_balance': 100000,
+                             'current_balance': 100000}).set_index('party')
+
+    def assign_all(tables):
+        for table in tables.values():
+            parties_assigner(n_parties, table, rng=rng)
+
+    def settle_all():
+        for p in prod_ids:
+            settlement_calculator(assigned[p], p, current_price=price[p])
+
+    def balance_all(bal):
+        for p in prod_ids:
+            bal = balance_calculator(bal, settlements[p], settlements[p])
+
+    def sheet_all(sheet):
+        for p in prod_ids:
+            sheet.set(p, settlements[p].index.values,
+                      settlements[p]['settlement_obligation'].values)
+        sheet.commit()
+
+    return {
+        'parties_assigner': measure(
+            assign_all, lambda: ({p: t.copy() for p, t in trades.items()},),
+            repeat),
+        'settlement_calculator': measure(settle_all, tuple, repeat),
+        'balance_calculator': measure(balance_all, lambda: (balances(),),
+                                      repeat),
+        'balance_sheet': measure(
+            sheet_all, lambda: (BalanceSheet(n_parties, prod_ids),), repeat)}
+
+
+def revision():
+    """
+    Short git revision of the working tree, None outside of a git checkout.
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_baseline(path):
+    """
+    Latest baseline record of every (function, trades, parties, products).
+    """
+    baseline = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                r = json.loads(line)
+                baseline[(r['function'], r['trades'], r['parties'],
+                          r['products'])] = r
+
+    return baseline
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--trades', type=int, nargs='+',
+                        default=[10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6,
+                                 10 ** 7],
+                        help='total trade counts of the grid')
+    parser.add_argument('--parties', type=int, nargs='+',
+                        default=[10, 10 ** 3, 10 ** 5],
+                        help='party counts of the grid')
+    parser.add_argument('--products', type=int, nargs='+', default=[1, 4],
+                        help='product counts of the grid')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs per function, the best is kept')
+    parser.add_argument('--output',
+                        default=os.path.join(HERE, 'settlement_path.jsonl'),
+                        help='JSON lines file the results are appended to')
+    parser.add_argument('--baseline',
+                        help='JSON lines file of an earlier run to compare '
+                             'wall times with')
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline) if args.baseline else {}
+    rev = revision()
+    stamp = dt.datetime.utcnow().isoformat(timespec='seconds') + 'Z'
+
+    print('%-22s %9s %7s %8s %11s %10s %8s' % (
+        'function', 'trades', 'parties', 'products', 'seconds', 'peak MB',
+        'vs base'))
+
+    with open(args.output, 'a') as out:
+        for n_trades in args.trades:
+            for n_parties in args.parties:
+                for n_products in args.products:
+                    # Fewer runs where a single run already takes seconds
+                    repeat = args.repeat if n_trades < 10 ** 6 else 1
+                    results = run_point(n_trades, n_parties, n_products,
+                                        repeat)
+
+                    for name, (seconds, peak) in results.items():
+                        record = {'function': name, 'trades': n_trades,
+                                  'parties': n_parties,
+                                  'products': n_products,
+                                  'seconds': seconds, 'peak_bytes': peak,
+                                  'revision': rev, 'timestamp': stamp,
+                                  'numpy': np.__version__,
+                                  'pandas': pd.__version__}
+                        out.write(json.dumps(record) + '\n')
+                        out.flush()
+
+                        base = baseline.get((name, n_trades, n_parties,
+                                             n_products))
+                        ratio = '%7.2fx' % (seconds / base['seconds']) \
+                            if base else ''
+                        print('%-22s %9d %7d %8d %11.5f %10.1f %8s' % (
+                            name, n_trades, n_parties, n_products, seconds,
+                            peak / 2 ** 20, ratio))
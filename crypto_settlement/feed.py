@@ -0,0 +1,242 @@
+import asyncio
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from main import iso_parser, settle_product
+from settlement_engine import SettlementEngine
+
+WS_URL = 'wss://ws-feed.gdax.com'
+
+
+async def websocket_feed(prod_ids, url=WS_URL, max_queue=16):
+    """
+    Stream the match (trade) messages of given products from the GDAX
+    websocket feed. Requires the websockets package.
+
+    The connection buffers at most max_queue frames, so a consumer falling
+    behind stops the reads from the socket and TCP pushes back on the feed.
+
+    args:
+        prod_ids: list of product IDs
+        url: url of the websocket feed
+        max_queue: incoming frames buffered by the connection
+
+    return: async iterator of decoded messages
+    """
+    import websockets
+
+    async with websockets.connect(url, max_queue=max_queue) as ws:
+        await ws.send(json.dumps({'type': 'subscribe',
+                                  'product_ids': list(prod_ids),
+                                  'channels': ['matches']}))
+        async for message in ws:
+            yield json.loads(message)
+
+
+async def replay_feed(path, speed=None):
+    """
+    Stand-in for the websocket feed that replays recorded messages from a
+    JSONL file, one message per line, for offline runs and tests.
+
+    args:
+        path: path of the JSONL file
+        speed: replay speed relative to the recorded message times, None to
+        replay as fast as possible
+
+    return: async iterator of decoded messages
+    """
+    start = None
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            message = json.loads(line)
+
+            if speed is not None and 'time' in message:
+                t = np.datetime64(message['time'].rstrip('Z'), 'ns')
+                if start is None:
+                    start = (t, time.monotonic())
+                delay = (t - start[0]) / np.timedelta64(1, 's') / speed - \
+                    (time.monotonic() - start[1])
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            yield message
+            await asyncio.sleep(0)
+
+
+class StreamingSettlement(object):
+    """
+    Event-driven settlement of a stream of match messages.
+
+    A reader task pushes the trades of the stream into a bounded queue as
+    they arrive, and a consumer task drains the queue in batches into the
+    products' settlement engines. Settlement runs every interval seconds or
+    as soon as every_n trades are pending, whichever comes first. When the
+    consumer falls behind the queue fills up and the reader waits for room,
+    which pushes back on the stream instead of growing memory without bound;
+    the time spent waiting is counted in blocked_seconds.
+
+    The current price of a product is the price of its latest trade, so no
+    ticker request is needed.
+    """
+
+    def __init__(self, prod_ids, on_settle, n_parties=10, window_size=3600,
+                 interval=10, every_n=None, max_queue=10000,
+                 event_time=False, rng=None, seed=None, archive=None,
+                 on_tick=None):
+        """
+        args:
+            prod_ids: list of product IDs to settle
+            on_settle: called with (prod_id, settlements table) after each
+            settlement of a product
+            n_parties: total number of counter parties
+            window_size: settlement window size in seconds
+            interval: seconds between settlements
+            every_n: also settle when this many trades are pending, None to
+            settle on the timer only
+            max_queue: capacity of the queue between reader and consumer
+            event_time: end settlement windows at the latest trade time
+            instead of the wall clock, for replays
+            rng: optional numpy Generator used to assign the parties
+            seed: run seed to hash the parties from the trade ids instead,
+            so replays of a feed assign every trade the same way
+            archive: optional Archive the trades are written to
+            on_tick: called without arguments once every product of a
+            settlement round is settled
+        """
+        self.prod_ids = list(prod_ids)
+        self.on_settle = on_settle
+        self.on_tick = on_tick
+        self.n_parties = n_parties
+        self.interval = interval
+        self.every_n = every_n
+        self.max_queue = max_queue
+        self.event_time = event_time
+        self.rng = rng
+        self.seed = seed
+        self.archive = archive
+
+        self.engines = {p: SettlementEngine(p, n_parties=n_parties,
+                                            window_size=window_size)
+                        for p in self.prod_ids}
+        self.pending = {p: [] for p in self.prod_ids}
+        self.n_pending = 0
+        self.last_price = {}
+        self.last_time = None
+
+        self.n_received = 0
+        self.n_settlements = 0
+        self.max_depth = 0
+        self.blocked_seconds = 0.0
+
+    async def _reader(self, source, queue):
+        try:
+            async for message in source:
+                if message.get('type') != 'match' or \
+                        message.get('product_id') not in self.pending:
+                    continue
+
+                if queue.full():
+                    start = time.monotonic()
+                    await queue.put(message)
+                    self.blocked_seconds += time.monotonic() - start
+                else:
+                    queue.put_nowait(message)
+                self.max_depth = max(self.max_depth, queue.qsize())
+        finally:
+            await queue.put(None)
+
+    async def _consumer(self, queue):
+        deadline = time.monotonic() + self.interval
+
+        while True:
+            try:
+                message = await asyncio.wait_for(
+                    queue.get(), max(0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                message = False
+
+            # Drain whatever else is already queued as one batch
+            done = message is None
+            batch = [message] if message else []
+            while not done and not queue.empty():
+                message = queue.get_nowait()
+                if message is None:
+                    done = True
+                else:
+                    batch.append(message)
+
+            for message in batch:
+                self.pending[message['product_id']].append(message)
+            self.n_pending += len(batch)
+            self.n_received += len(batch)
+
+            if done:
+                self.settle()
+                return
+
+            if time.monotonic() >= deadline or \
+                    (self.every_n and self.n_pending >= self.every_n):
+                self.settle()
+                deadline = time.monotonic() + self.interval
+
+    def _trades(self, messages):
+        """
+        Convert match messages to a trades table indexed by trade_id.
+        """
+        trades = pd.DataFrame(
+            {'time': iso_parser(pd.Series([m['time'] for m in messages])),
+             'price': np.array([m['price'] for m in messages], dtype=float),
+             'size': np.array([m['size'] for m in messages], dtype=float),
+             'side': [m.get('side') for m in messages]})
+        trades.index = pd.Index(np.array([m['trade_id'] for m in messages],
+                                         dtype=np.int64), name='trade_id')
+
+        return trades.sort_index(ascending=False)
+
+    def settle(self):
+        """
+        Add the pending trades to the engines and settle every product that
+        has a price.
+        """
+        for prod_id, messages in self.pending.items():
+            if messages:
+                trades = self._trades(messages)
+                self.last_price[prod_id] = float(trades['price'].iloc[0])
+                last_time = trades['time'].max()
+                if self.last_time is None or last_time > self.last_time:
+                    self.last_time = last_time
+                self.pending[prod_id] = []
+            else:
+                trades = self._trades([])
+
+            if prod_id in self.last_price:
+                now = self.last_time.to_pydatetime() if self.event_time \
+                    else None
+                settlements, _ = settle_product(self.engines[prod_id], trades,
+                                                self.last_price[prod_id],
+                                                self.n_parties, self.rng, now,
+                                                self.seed, self.archive)
+                self.on_settle(prod_id, settlements)
+
+        if self.on_tick is not None:
+            self.on_tick()
+
+        self.n_pending = 0
+        self.n_settlements += 1
+
+    async def run(self, source):
+        """
+        Consume the stream until it ends, settling along the way.
+
+        args:
+            source: async iterator of feed messages, eg. websocket_feed or
+            replay_feed
+        """
+        queue = asyncio.Queue(self.max_queue)
+        await asyncio.gather(self._reader(source, queue),
+                             self._consumer(queue))
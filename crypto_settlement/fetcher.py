@@ -0,0 +1,109 @@
+import asyncio
+import json
+
+import aiohttp
+
+API_URL = 'https://api.gdax.com'
+
+
+class AsyncFetcher(object):
+    """
+    Fetch trades and tickers of many products concurrently over one pooled
+    keep-alive HTTP session.
+
+    All requests of a tick are issued at once with asyncio.gather, so tick
+    latency stays close to a single round trip as the product list grows,
+    and connections are reused between ticks instead of reopened per call.
+
+    The session has to be opened inside a running event loop, either with
+    "async with AsyncFetcher() as fetcher" or with open() / close().
+    """
+
+    def __init__(self, api_url=API_URL, max_connections=20, timeout=30,
+                 keepalive_timeout=60):
+        """
+        args:
+            api_url: base url of the exchange api, point it to a local stub
+            server for testing
+            max_connections: size of the connection pool
+            timeout: total timeout of each request, in seconds
+            keepalive_timeout: how long idle connections are kept open
+        """
+        self.api_url = api_url.rstrip('/')
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.session = None
+
+    async def open(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            keepalive_timeout=self.keepalive_timeout)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+        return self
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _get(self, path, params=None):
+        """
+        GET a path of the api and return the raw response body.
+        """
+        async with self.session.get(self.api_url + path,
+                                    params=params) as r:
+            r.raise_for_status()
+            return await r.read()
+
+    async def trades(self, prod_id, params=None):
+        """
+        Retrieve the latest page of trades of given product.
+
+        args:
+            prod_id: product ID, eg. BTC-USD, ETH-USD
+            params: optional query parameters, eg. pagination cursor
+
+        return: raw JSON response body
+        """
+        return await self._get('/products/{}/trades'.format(prod_id), params)
+
+    async def ticker(self, prod_id):
+        """
+        Retrieve the latest trade price of given product.
+
+        args:
+            prod_id: product ID, eg. BTC-USD, ETH-USD
+
+        return: latest trade price as float
+        """
+        body = await self._get('/products/{}/ticker'.format(prod_id))
+
+        return float(json.loads(body)['price'])
+
+    async def fetch_all(self, prod_ids, tickers=True):
+        """
+        Retrieve trades and ticker of every product concurrently.
+
+        args:
+            prod_ids: list of product IDs
+            tickers: also retrieve the tickers, else the prices are None
+
+        return: dict mapping product ID to (raw trades body, ticker price)
+        """
+        results = await asyncio.gather(
+            *[self.trades(p) for p in prod_ids],
+            *[self.ticker(p) for p in prod_ids if tickers])
+
+        n = len(prod_ids)
+        prices = results[n:] if tickers else [None] * n
+        return dict(zip(prod_ids, zip(results[:n], prices)))
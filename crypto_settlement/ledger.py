@@ -0,0 +1,227 @@
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# One journal record: a header followed by n (party, delta) entries
+HEADER = np.dtype([('seq', '<i8'), ('product', '<i4'), ('n', '<i4')])
+ENTRY = np.dtype([('party', '<i4'), ('delta', '<f8')])
+
+
+class Ledger(object):
+    """
+    Durable settlement ledger: the balance of every party plus the last
+    settlement obligation of every party in every product.
+
+    Each update writes the per-party obligation deltas of one product to an
+    append-only binary journal. Every snapshot_every updates the whole state
+    is written to a memory-mapped .npy snapshot and a new journal segment is
+    started, so recovery maps the latest snapshot and replays only the
+    updates made since, however long the ledger has been running.
+
+    Files in the ledger directory:
+        products.json: product ids, in the order of the obligation rows
+        snapshot-<seq>.npy: row 0 holds balances, row i + 1 the obligations
+        of product i, after update number seq
+        journal-<seq>.bin: the updates made after snapshot seq
+    """
+
+    def __init__(self, path, n_parties=10, initial_balance=100000,
+                 snapshot_every=1000, sync=False):
+        """
+        args:
+            path: directory of the ledger, created if missing
+            n_parties: initial number of counter parties, grown on demand
+            initial_balance: balance of each party in a new ledger
+            snapshot_every: number of updates between snapshots
+            sync: fsync the journal after every update
+        """
+        self.path = path
+        self.initial_balance = initial_balance
+        self.snapshot_every = snapshot_every
+        self.sync = sync
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self.products = []
+        products_file = os.path.join(path, 'products.json')
+        if os.path.exists(products_file):
+            with open(products_file) as f:
+                self.products = json.load(f)
+
+        self.seq = 0
+        self.state = np.zeros((1 + len(self.products), n_parties))
+        self.state[0] = initial_balance
+        self._recover()
+
+    @property
+    def balances(self):
+        return self.state[0]
+
+    def obligations(self, prod_id):
+        return self.state[1 + self.products.index(prod_id)]
+
+    def _file(self, kind, seq):
+        return os.path.join(self.path, '{}-{:012d}.{}'.format(
+            kind, seq, 'npy' if kind == 'snapshot' else 'bin'))
+
+    def _recover(self):
+        """
+        Map the latest snapshot and replay the journal segment after it.
+        """
+        snapshots = sorted(glob.glob(os.path.join(self.path,
+                                                  'snapshot-*.npy')))
+        if snapshots:
+            self.seq = int(os.path.basename(snapshots[-1])[9:21])
+            snapshot = np.load(snapshots[-1], mmap_mode='r')
+            self._resize(len(self.products), snapshot.shape[1])
+            self.state[:snapshot.shape[0], :snapshot.shape[1]] = snapshot
+            del snapshot
+
+        journal_file = self._file('journal', self.seq)
+        snapshot_seq = self.seq
+
+        if os.path.exists(journal_file):
+            with open(journal_file, 'rb') as f:
+                data = f.read()
+
+            offset = 0
+            while offset + HEADER.itemsize <= len(data):
+                header = np.frombuffer(data, HEADER, 1, offset)[0]
+                end = offset + HEADER.itemsize + int(header['n']) * \
+                    ENTRY.itemsize
+                if end > len(data):
+                    break
+                entries = np.frombuffer(data, ENTRY, int(header['n']),
+                                        offset + HEADER.itemsize)
+                self._apply(int(header['product']), entries['party'],
+                            entries['delta'])
+                self.seq = int(header['seq'])
+                offset = end
+
+            if offset < len(data):
+                # Drop a record torn by a crash in the middle of a write
+                with open(journal_file, 'r+b') as f:
+                    f.truncate(offset)
+
+        self._journal = open(journal_file, 'ab')
+
+        if self.seq - snapshot_seq >= self.snapshot_every:
+            self.snapshot()
+
+    def _resize(self, n_products, n_parties):
+        """
+        Grow the state so n_products and party ids below n_parties fit.
+        """
+        rows, cols = self.state.shape
+        if 1 + n_products > rows or n_parties > cols:
+            state = np.zeros((max(rows, 1 + n_products),
+                              max(cols, n_parties)))
+            state[0, cols:] = self.initial_balance
+            state[:rows, :cols] = self.state
+            self.state = state
+
+    def _apply(self, product, party, delta):
+        """
+        Apply obligation deltas of one product to obligations and balances.
+        """
+        self._resize(product + 1, int(party.max(initial=-1)) + 1)
+        self.state[1 + product, party] += delta
+        self.state[0, party] -= delta
+
+    def _product(self, prod_id):
+        """
+        Row of the product, registering it first if it is new.
+        """
+        if prod_id not in self.products:
+            self.products.append(prod_id)
+            tmp = os.path.join(self.path, 'products.json.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(self.products, f)
+            os.replace(tmp, os.path.join(self.path, 'products.json'))
+            self._resize(len(self.products), 0)
+
+        return self.products.index(prod_id)
+
+    def update(self, prod_id, party, obligation):
+        """
+        Replace the settlement obligations of given product, journal the
+        change and apply it to the balances, with the same semantics as
+        balance_calculator.
+
+        args:
+            prod_id: product ID, eg. BTC-USD, ETH-USD
+            party: int array of parties
+            obligation: new settlement obligation of each party; parties not
+            given have no trades in the window and their obligation becomes
+            0, as does NaN (zero net quantity)
+
+        return: the balances of all parties
+        """
+        product = self._product(prod_id)
+        party = np.asarray(party, dtype=np.int32)
+        obligation = np.nan_to_num(np.asarray(obligation, dtype=np.float64))
+        self._resize(len(self.products), int(party.max(initial=-1)) + 1)
+
+        target = np.zeros(self.state.shape[1])
+        target[party] = obligation
+        delta = target - self.state[1 + product]
+        changed = np.flatnonzero(delta)
+
+        entries = np.empty(len(changed), ENTRY)
+        entries['party'] = changed
+        entries['delta'] = delta[changed]
+        header = np.array([(self.seq + 1, product, len(entries))], HEADER)
+
+        self._journal.write(header.tobytes() + entries.tobytes())
+        self._journal.flush()
+        if self.sync:
+            os.fsync(self._journal.fileno())
+
+        self._apply(product, entries['party'], entries['delta'])
+        self.seq += 1
+
+        if self.seq % self.snapshot_every == 0:
+            self.snapshot()
+
+        return self.balances
+
+    def snapshot(self):
+        """
+        Write the whole state to a new snapshot, start a new journal segment
+        and remove the older snapshot and segments.
+        """
+        tmp = self._file('snapshot', self.seq) + '.tmp'
+        snapshot = np.lib.format.open_memmap(tmp, mode='w+',
+                                             dtype=self.state.dtype,
+                                             shape=self.state.shape)
+        snapshot[:] = self.state
+        snapshot.flush()
+        del snapshot
+        os.replace(tmp, self._file('snapshot', self.seq))
+
+        self._journal.close()
+        self._journal = open(self._file('journal', self.seq), 'ab')
+
+        keep = {self._file('snapshot', self.seq),
+                self._file('journal', self.seq)}
+        for f in glob.glob(os.path.join(self.path, 'snapshot-*.npy')) + \
+                glob.glob(os.path.join(self.path, 'journal-*.bin')):
+            if f not in keep:
+                os.remove(f)
+
+    def close(self):
+        self._journal.close()
+
+    def frame(self):
+        """
+        The balances in the layout of the balances table of the main loop.
+        """
+        balances = pd.DataFrame({'party': range(self.state.shape[1]),
+                                 'initial_balance': self.initial_balance,
+                                 'current_balance': self.balances})
+
+        return balances.set_index('party')
@@ -1,12 +1,25 @@
 import numpy as np
 import pandas as pd
 import datetime as dt
-import time
 import requests
 import logging
 import sys
+import argparse
+import asyncio
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
 
-pd.options.mode.chained_assignment = None
+from settlement_engine import SettlementEngine, MultiWindowVWAP
+from trade_store import TradeStore
+from netting import net_positions, settlement_table
+from ledger import Ledger
+from balances import BalanceSheet
+from scheduler import TickScheduler
+from metrics import METRICS
+from ticker import TickerCache
+
+API_URL = 'https://api.gdax.com'
 
 
 def iso_converter(s):
@@ -27,7 +40,116 @@ def iso_converter(s):
     return t
 
 
-def data_retriever(prod_id='BTC-USD'):
+def iso_parser(s):
+    """
+    Vectorized version of iso_converter: convert a column of iso format
+    strings to datetime64[ns] in bulk.
+
+    Both the "%Y-%m-%dT%H:%M:%SZ" and "%Y-%m-%dT%H:%M:%S.%fZ" variants are
+    handled by stripping the trailing "Z" and letting numpy parse the
+    fixed-width strings, instead of calling strptime for each row.
+
+    args:
+        s: a Series of strings in iso format
+
+    return: a datetime64[ns] Series with the same index
+    """
+    values = np.char.rstrip(np.asarray(s, dtype=str), 'Z')
+
+    return pd.Series(values.astype('datetime64[ns]'), index=s.index,
+                     name=s.name)
+
+
+def trades_frame(body):
+    """
+    Convert a raw trades response body of GDAX api to the trades table.
+
+    With pyarrow installed the body is parsed straight into typed columns
+    by trades_arrow, without building a Python dict and strings per trade.
+    Either way price and size come out as float64 and time as
+    datetime64[ns], so nothing downstream has to convert them again.
+
+    args:
+        body: JSON response body of the /products/{id}/trades endpoint
+
+    return: trades table indexed by trade_id
+    """
+    if body.strip() in (b'[]', b''):
+        return pd.DataFrame(
+            {'time': pd.Series([], dtype='datetime64[ns]'),
+             'price': pd.Series([], dtype=np.float64),
+             'size': pd.Series([], dtype=np.float64)},
+            index=pd.Index([], name='trade_id', dtype=np.int64))
+
+    try:
+        return trades_arrow(body)
+    except ImportError:
+        pass
+
+    with METRICS.stage('decode') as stage:
+        raw_data = json.loads(body)
+        stage.rows = len(raw_data)
+
+        # Convert to dataframe and keep desired amount of data
+        df = pd.DataFrame(raw_data).set_index('trade_id')
+
+    # Convert string to datetime64 and float64 columns
+    with METRICS.stage('parse', len(df)):
+        df['time'] = iso_parser(df['time'])
+        df['price'] = df['price'].values.astype(np.float64)
+        df['size'] = df['size'].values.astype(np.float64)
+
+    return df
+
+
+def trades_arrow(body):
+    """
+    Decode a trades response body with the pyarrow JSON reader.
+
+    The reader takes one object per line, so the separators between the
+    objects of the array are turned into newlines on the raw bytes first;
+    no value of a trade contains line breaks or braces. A compact body, as
+    the exchange sends it, only needs a plain replace, and any other layout
+    is normalized with a regular expression. Requires the pyarrow package.
+
+    args:
+        body: JSON response body of the /products/{id}/trades endpoint
+
+    return: trades table indexed by trade_id
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.json as pj
+
+    options = pj.ParseOptions(explicit_schema=pa.schema([
+        ('time', pa.timestamp('ns')), ('trade_id', pa.int64()),
+        ('price', pa.string()), ('size', pa.string())]))
+
+    with METRICS.stage('decode') as stage:
+        body = body.strip()[1:-1]
+        try:
+            table = pj.read_json(
+                pa.BufferReader(body.replace(b'},{', b'}\n{')),
+                parse_options=options)
+        except pa.ArrowInvalid:
+            lines = re.sub(rb'}\s*,\s*{', b'}\n{',
+                           body.translate(None, b'\r\n'))
+            table = pj.read_json(pa.BufferReader(lines),
+                                 parse_options=options)
+        stage.rows = table.num_rows
+
+    # Prices and sizes are quoted in the response: cast the columns at once
+    with METRICS.stage('parse', table.num_rows):
+        for name in ['price', 'size']:
+            i = table.schema.get_field_index(name)
+            table = table.set_column(i, name,
+                                     pc.cast(table[name], pa.float64()))
+        df = table.to_pandas().set_index('trade_id')
+
+    return df
+
+
+def data_retriever(prod_id='BTC-USD', api_url=API_URL):
     """
     This function will connect to GDAX api and receive live trading data of
     given product. The trade data of each product include: trade_id, time,
@@ -35,25 +157,207 @@ def data_retriever(prod_id='BTC-USD'):
 
     args:
         prod_id: product ID, eg. BTC-USD, ETH-USD
+        api_url: base url of the exchange api
 
     return: new data retrieved from GDAX
     """
 
-    url = 'https://api.gdax.com/products/{}/trades'.format(str(prod_id))
-    r = requests.get(url)
+    url = '{}/products/{}/trades'.format(api_url, str(prod_id))
+    with METRICS.stage('fetch'):
+        r = requests.get(url)
 
-    raw_data = r.json()
+    return trades_frame(r.content)
 
-    # Convert to dataframe and keep desired amount of data
-    df = pd.DataFrame(raw_data).set_index('trade_id')
 
-    # Convert string to datetime object
-    df['time'] = df['time'].apply(iso_converter)
+def data_backfill(prod_id='BTC-USD', window_size=3600, watermark=None,
+                  api_url=API_URL, session=None, limit=1000):
+    """
+    Retrieve every trade of given product back to the start of the moving
+    window, following the exchange's pagination cursor.
 
-    return df
+    GDAX returns the cursor of the next (older) page in the CB-AFTER header,
+    the oldest trade_id of the page. The request for the next page is sent
+    only while the page reaches neither the stored watermark nor the start
+    of the window, and runs while the current page is filtered. Paging stops
+    at the first page reaching either, so a regular tick costs a single
+    request while a startup backfill still covers the whole window.
+
+    args:
+        prod_id: product ID, eg. BTC-USD, ETH-USD
+        window_size: how far back to retrieve trades, in seconds
+        watermark: largest trade_id already stored, None if nothing is stored
+        api_url: base url of the exchange api
+        session: optional requests.Session reused for keep-alive connections
+        limit: number of trades requested per page
+
+    return: trades within the window and above the watermark, sorted by
+    trade_id in descending order
+    """
+    if session is None:
+        session = requests.Session()
+
+    url = '{}/products/{}/trades'.format(api_url, str(prod_id))
+    cutoff = np.datetime64(dt.datetime.utcnow() -
+                           dt.timedelta(seconds=window_size), 'ns')
+
+    pages = []
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(session.get, url, params={'limit': limit})
+
+        while future is not None:
+            with METRICS.stage('fetch'):
+                r = future.result()
+            r.raise_for_status()
+
+            cursor = r.headers.get('CB-AFTER')
+            future = None
+            if cursor and watermark is not None and int(cursor) <= watermark:
+                # The page reaches the watermark, nothing older is needed
+                cursor = None
+
+            page = trades_frame(r.content)
+            if len(page) == 0:
+                break
+
+            reached = page['time'].values.min() <= cutoff
+            if watermark is not None:
+                reached |= page.index.values.min() <= watermark
+                page = page[page.index.values > watermark]
+
+            # Prefetch the next page while this one is filtered
+            if cursor and not reached:
+                future = executor.submit(session.get, url,
+                                         params={'after': cursor,
+                                                 'limit': limit})
+
+            pages.append(page[page['time'].values > cutoff])
+
+    if len(pages) == 0:
+        return trades_frame(b'[]')
+
+    trades = pd.concat(pages)
+    if not trades.index.is_monotonic_decreasing:
+        trades = trades.sort_index(ascending=False)
+
+    return trades
 
 
-def parties_assigner(n_parties, table1, table2=None):
+def parties_sampler(n_parties, n_trades, rng=None):
+    """
+    Draw long and short parties for a block of trades in one vectorized
+    operation.
+
+    The long side is drawn uniformly from all parties, and the short side
+    uniformly from the remaining n_parties - 1 parties by adding a non-zero
+    offset modulo n_parties, so long != short is guaranteed for every trade.
+
+    args:
+        n_parties: total number of counter parties, at least 2
+        n_trades: number of trades to assign
+        rng: optional numpy Generator, pass a seeded one for reproducible runs
+
+    return: two int arrays holding long and short parties of each trade
+    """
+    if n_parties < 2:
+        raise ValueError('At least 2 parties are needed, got %d.' % n_parties)
+
+    if rng is None:
+        rng = np.random.default_rng()
+
+    long = rng.integers(0, n_parties, n_trades)
+    short = (long + rng.integers(1, n_parties, n_trades)) % n_parties
+
+    return long, short
+
+
+def splitmix64(x):
+    """
+    SplitMix64 finalizer, a fast well-mixing hash of 64 bit integers.
+
+    args:
+        x: uint64 array
+
+    return: uint64 array of hashes
+    """
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+
+    return x ^ (x >> np.uint64(31))
+
+
+def parties_hasher(n_parties, trade_ids, seed=0):
+    """
+    Derive long and short parties of trades from a hash of their trade_id
+    and a run seed.
+
+    The same trade always gets the same parties under the same seed, so any
+    process can assign any subset of trades on its own and restarts and
+    replays reproduce earlier runs without storing the assignments. As in
+    parties_sampler the short side is the long side plus a non-zero offset
+    modulo n_parties, so long != short for every trade.
+
+    args:
+        n_parties: total number of counter parties, at least 2
+        trade_ids: int array of trade ids
+        seed: run seed, non-negative integer
+
+    return: two int arrays holding long and short parties of each trade
+    """
+    if n_parties < 2:
+        raise ValueError('At least 2 parties are needed, got %d.' % n_parties)
+
+    key = splitmix64(np.array([seed], dtype=np.uint64))
+    h1 = splitmix64(np.asarray(trade_ids).astype(np.uint64) ^ key)
+    h2 = splitmix64(h1)
+
+    long = (h1 % np.uint64(n_parties)).astype(np.int64)
+    short = (long + 1 + (h2 % np.uint64(n_parties - 1)).astype(np.int64)) \
+        % n_parties
+
+    return long, short
+
+
+def parties_drawer(n_parties, trades, rng=None, seed=None):
+    """
+    Long and short parties of the trades, hashed from their trade_id when a
+    seed is given, else drawn at random.
+    """
+    if seed is not None:
+        return parties_hasher(n_parties, trades.index.values, seed)
+
+    return parties_sampler(n_parties, len(trades), rng)
+
+
+def watermark_filter(trades, watermark):
+    """
+    Keep only the trades above the high-water mark trade_id.
+
+    GDAX trade ids increase monotonically per product, so every trade with an
+    id not above the largest id already stored has been seen before.
+
+    args:
+        trades: newly retrieved trades indexed by trade_id
+        watermark: largest trade_id already stored, None if nothing is stored
+
+    return: the new trades sorted by trade_id in descending order, and the
+    updated watermark
+    """
+    if watermark is not None:
+        trades = trades[trades.index.values > watermark]
+
+    if len(trades) == 0:
+        return trades, watermark
+
+    if not trades.index.is_monotonic_decreasing:
+        trades = trades.sort_index(ascending=False)
+
+    return trades, int(trades.index[0])
+
+
+def parties_assigner(n_parties, table1, table2=None, rng=None,
+                     dedupe='merge', seed=None):
     """
     This function will assign buyers and sellers to each trade.
 
@@ -64,11 +368,38 @@ def parties_assigner(n_parties, table1, table2=None):
     args:
         n_parties: total number of counter parties
         table: the table of trades with assigned counter parties.
+        rng: optional numpy Generator used to draw the parties
+        dedupe: how new trades in table2 are found. 'merge' runs an outer
+        merge over the whole history; 'watermark' keeps only trade ids above
+        the largest one in table1 and prepends them without re-sorting, which
+        requires table1 to be sorted by trade_id in descending order (as this
+        function returns it).
+        seed: run seed; when given the parties are hashed from the trade_id
+        with parties_hasher instead of drawn, and rng is ignored
     """
 
-    parties_list = []
+    if table2 is not None and dedupe == 'watermark':
+        watermark = int(table1.index[0]) if len(table1) > 0 else None
+        new_rows, _ = watermark_filter(table2, watermark)
+
+        if len(new_rows) > 0:
+
+            print('Newly added %.2f trades.' % len(new_rows))
+
+            new_rows = new_rows.copy()
+            new_rows['long'], new_rows['short'] = \
+                parties_drawer(n_parties, new_rows, rng, seed)
+
+            # New rows all sit above the watermark: prepending them keeps the
+            # table sorted without touching the history
+            table1 = pd.concat([new_rows, table1])
+
+        return table1
+
+    elif table2 is not None:
+        if dedupe != 'merge':
+            raise ValueError('Unknown dedupe mode: %s' % dedupe)
 
-    if table2 is not None:
         merged = table1.reset_index().merge(table2.reset_index(),
                                             indicator=True,
                                             how='outer').set_index('trade_id')
@@ -79,30 +410,61 @@ def parties_assigner(n_parties, table1, table2=None):
 
             print('Newly added %.2f trades.' % len(new_rows))
 
-            for i in np.arange(len(new_rows)):
-                parties_list.append(np.random.choice(n_parties, 2,
-                                                     replace=False))
-
-            parties_list = np.array(parties_list)
-
-            new_rows['long'] = parties_list[:, 0]
-            new_rows['short'] = parties_list[:, 1]
+            new_rows['long'], new_rows['short'] = \
+                parties_drawer(n_parties, new_rows, rng, seed)
 
             table1 = pd.concat([table1, new_rows])
 
     else:
-        for i in np.arange(len(table1)):
-            parties_list.append(np.random.choice(n_parties, 2, replace=False))
+        long, short = parties_drawer(n_parties, table1, rng, seed)
+        table1 = table1.assign(long=long, short=short)
 
-        parties_list = np.array(parties_list)
+    return table1.sort_index(ascending=False)
 
-        table1['long'] = parties_list[:, 0]
-        table1['short'] = parties_list[:, 1]
 
-    return table1.sort_index(ascending=False)
+def ticker_price(prod_id, api_url=API_URL):
+    """
+    Retrieve the latest trade price of given product from GDAX ticker.
+
+    args:
+        prod_id: product ID, eg. BTC-USD, ETH-USD
+        api_url: base url of the exchange api
+
+    return: latest trade price as float
+    """
+    with METRICS.stage('ticker'):
+        r = requests.get('{}/products/{}/ticker'.format(api_url, prod_id))
+
+    return float(r.json()['price'])
+
 
+# Current prices shared by the settlement calculators of this process
+TICKERS = TickerCache(ticker_price)
 
-def settlement_calculator(trade_data, prod_id, window_size=3600):
+
+def time_window(times, cutoff):
+    """
+    Slice of the trades after cutoff, found by binary search.
+
+    args:
+        times: datetime64 array of trade times, sorted in either direction,
+        eg. the trades table sorted by trade_id in descending order
+        cutoff: start of the window, exclusive
+
+    return: slice of the positions with times after cutoff, so indexing a
+    column with it gives a view
+    """
+    if len(times) == 0 or times[0] <= times[-1]:
+        return slice(np.searchsorted(times, cutoff, side='right'),
+                     len(times))
+
+    # Descending: search the reversed view
+    return slice(0, len(times) - np.searchsorted(times[::-1], cutoff,
+                                                 side='right'))
+
+
+def settlement_calculator(trade_data, prod_id, window_size=3600,
+                          current_price=None):
     """
     This function will calculate the volume weighted average price (VWAP) in
     the moving window of given size and calculate settlement obligations of
@@ -119,54 +481,128 @@ def settlement_calculator(trade_data, prod_id, window_size=3600):
 
     args:
         trade_data: the data should contain information of product, price,
-        volume, time, buyer & sellers.
+        volume, time, buyer & sellers. Either a trades table sorted by time,
+        as parties_assigner returns it, or a TradeStore; both are read
+        through views without copying.
         prod_id: the product id, eg. BTC-USD, ETH-USD
         window_size: the moving window size used to calculate volume
         weighted average price.
+        current_price: latest trade price, retrieved from the ticker if not
+        given
 
     return: settlements table which has settlement information of each party.
     """
 
-    # Take the data of lastest hour
-    last_hr_data = trade_data[trade_data['time'] > dt.datetime.utcnow() -
-                              dt.timedelta(seconds=window_size)]
+    if isinstance(trade_data, TradeStore):
+        # Read the latest hour straight from the store's arrays
+        window = trade_data.window(np.datetime64(
+            dt.datetime.utcnow() - dt.timedelta(seconds=window_size),
+            'ns').astype(np.int64))
+        long, short = window['long'], window['short']
+        price, size = window['price'], window['size']
 
-    # Calculate worth of each trade
-    last_hr_data['price'] = last_hr_data['price'].astype(float)
-    last_hr_data['size'] = last_hr_data['size'].astype(float)
-    last_hr_data['trade_worth'] = last_hr_data['price'] * last_hr_data['size']
+    else:
+        # Take the data of lastest hour: the trades are sorted by time, so
+        # the window is a contiguous block found by binary search
+        window = time_window(trade_data['time'].values, np.datetime64(
+            dt.datetime.utcnow() - dt.timedelta(seconds=window_size), 'ns'))
+        long = trade_data['long'].values[window]
+        short = trade_data['short'].values[window]
+        price = trade_data['price'].values[window].astype(np.float64,
+                                                         copy=False)
+        size = trade_data['size'].values[window].astype(np.float64,
+                                                       copy=False)
+
+    # Calculate total worth and quantity of crypto in all trade of each party
+    notional, quantity, n_trades = net_positions(long, short, price * size,
+                                                 size)
+
+    # Report every party with a trade in the window
+    party = np.flatnonzero(n_trades)
+
+    # Retrieve latest trade price: the newest trade in memory has it, else
+    # the shared ticker cache
+    if current_price is None:
+        if isinstance(trade_data, TradeStore) and len(price) > 0:
+            # The store is sorted by time
+            current_price = float(price[-1])
+            TICKERS.observe(prod_id, current_price)
+        elif isinstance(trade_data, TradeStore):
+            current_price = TICKERS.price(prod_id)
+        else:
+            current_price = TICKERS.price(prod_id, trade_data)
+
+    return settlement_table(prod_id, party, notional[party], quantity[party],
+                            current_price)
+
+
+def multi_settlement_calculator(trade_data, prod_id, window_sizes,
+                                current_price=None, n_parties=None):
+    """
+    Calculate settlements over several window sizes at once, eg. 1 minute, 5
+    minutes and 1 hour, from one pass over the longest window instead of one
+    settlement_calculator call per window.
 
-    # Calculate total worth of crypto in all trade of each party
-    total_worth = last_hr_data.groupby('long')['trade_worth'].sum() - \
-                  last_hr_data.groupby('short')['trade_worth'].sum()
+    args:
+        trade_data: a TradeStore, or a trades table which is loaded into one
+        prod_id: the product id, eg. BTC-USD, ETH-USD
+        window_sizes: list of window sizes in seconds
+        current_price: latest trade price, retrieved from the ticker if None
+        n_parties: number of counter parties
 
-    # Calculate total quantity of crypto in all trade for each party
-    total_quantity = last_hr_data.groupby('long')['size'].sum() - \
-                     last_hr_data.groupby('short')['size'].sum()
+    return: dict mapping window size to settlements table
+    """
+    if not isinstance(trade_data, TradeStore):
+        store = TradeStore(capacity=max(len(trade_data), 1))
+        store.append_frame(trade_data)
+        trade_data = store
 
-    # Calculate volume-weighted average price settlement value
-    settlements = pd.DataFrame(total_worth / total_quantity,
-                               columns=['vwap_value'])
+    if current_price is None:
+        price = trade_data.column('price')
+        current_price = float(price[-1]) if len(price) > 0 else \
+            TICKERS.price(prod_id)
 
-    # Assign currency USD
-    settlements['currency'] = prod_id[-3:]
+    return MultiWindowVWAP(prod_id, trade_data, n_parties).settlements(
+        window_sizes, current_price)
 
-    # Insert total quantity calculated earlier
-    settlements['quantity'] = total_quantity
 
-    # Rename index
-    settlements.index.names = ['party']
+def settle_product(engine, new_trades, current_price, n_parties, rng=None,
+                   now=None, seed=None, archive=None):
+    """
+    Run one settlement of a product on its SettlementEngine: keep only the
+    trades above the engine's watermark, assign them to counter parties, add
+    them to the engine and calculate settlements.
 
-    # Retrieve latest trade price
-    r = requests.get('https://api.gdax.com/products/{}/ticker'.format(prod_id))
-    settlements['current_price'] = float(r.json()['price'])
+    args:
+        engine: SettlementEngine of the product
+        new_trades: newly retrieved trades indexed by trade_id
+        current_price: latest trade price of the product
+        n_parties: total number of counter parties
+        rng: optional numpy Generator used to draw the parties
+        now: end of the settlement window, defaults to current UTC time
+        seed: run seed to hash the parties from the trade ids, None to draw
+        them with rng
+        archive: optional Archive the new trades are written to, with their
+        parties
+
+    return: settlements table and number of new trades
+    """
+    with METRICS.stage('assign') as timer:
+        new_trades, _ = watermark_filter(new_trades, engine.last_trade_id)
+        new_trades = parties_assigner(n_parties, new_trades, rng=rng,
+                                      seed=seed)
+        timer.rows = len(new_trades)
+
+    if archive is not None:
+        archive.add_trades(engine.prod_id, new_trades)
 
-    # Calculate settlement obligation of each party
-    settlements['settlement_obligation'] = (settlements['vwap_value'] -
-                                            settlements['current_price']) * \
-                                           settlements['quantity']
+    # Add only the new trades to the store and VWAP sums
+    with METRICS.stage('settle') as timer:
+        engine.add_trades(new_trades)
+        settlements = engine.settlements(current_price, now)
+        timer.rows = len(engine)
 
-    return settlements
+    return settlements, len(new_trades)
 
 
 def balance_calculator(bal, set, set_old=None):
@@ -194,78 +630,376 @@ def balance_calculator(bal, set, set_old=None):
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Crypto settlement loop.')
+    parser.add_argument('--products', nargs='+',
+                        default=['BTC-USD', 'ETH-USD'],
+                        help='product IDs to settle')
+    parser.add_argument('--parties', type=int, default=10,
+                        help='number of counter parties')
+    parser.add_argument('--interval', type=float, default=10,
+                        help='seconds between executions')
+    parser.add_argument('--fetch', choices=['sync', 'async'], default='sync',
+                        help='fetch products one after another, or '
+                             'concurrently over a pooled connection')
+    parser.add_argument('--api-url', default=API_URL,
+                        help='base url of the exchange api')
+    parser.add_argument('--window', type=int, default=3600,
+                        help='settlement window size in seconds')
+    parser.add_argument('--horizons', type=int, nargs='+', metavar='SECONDS',
+                        help='also report settlements over these window '
+                             'sizes, each at most --window')
+    parser.add_argument('--backfill', action='store_true',
+                        help='page back through the trades endpoint to the '
+                             'start of the window, then up to the stored '
+                             'watermark on every tick')
+    parser.add_argument('--ledger', metavar='DIR',
+                        help='keep balances in a persistent ledger in DIR, '
+                             'recovered on restart')
+    parser.add_argument('--snapshot-every', type=int, default=1000,
+                        help='ledger updates between snapshots')
+    parser.add_argument('--ledger-sync', action='store_true',
+                        help='fsync the ledger journal after every update, '
+                             'so it survives a power loss and not only a '
+                             'crash of the process')
+    parser.add_argument('--overrun', choices=TickScheduler.POLICIES,
+                        default='skip',
+                        help='what to do with the deadlines missed by a '
+                             'tick running longer than the interval')
+    parser.add_argument('--metrics-port', type=int,
+                        help='serve per-stage latency metrics in Prometheus '
+                             'text format at localhost:PORT/metrics')
+    parser.add_argument('--metrics-every', type=int, default=0,
+                        help='print a compact per-stage latency line every '
+                             'N ticks, 0 to disable')
+    parser.add_argument('--stream', action='store_true',
+                        help='consume the trade feed as a stream instead of '
+                             'polling, settling every interval seconds')
+    parser.add_argument('--feed-file', metavar='JSONL',
+                        help='with --stream, replay recorded feed messages '
+                             'instead of connecting to the live feed')
+    parser.add_argument('--replay-speed', type=float,
+                        help='with --feed-file, replay speed relative to '
+                             'the recorded times, default as fast as '
+                             'possible')
+    parser.add_argument('--settle-every-trades', type=int,
+                        help='with --stream, also settle as soon as this '
+                             'many trades are pending')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='settle products in this many worker '
+                             'processes, 0 to settle in this process')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='backtest on the trades recorded in a JSONL '
+                             'or Parquet file, on simulated time with ticks '
+                             'every interval seconds, and report throughput')
+    parser.add_argument('--replay-tickers', metavar='FILE',
+                        help='with --replay, recorded ticker prices; by '
+                             'default the latest trade price is used')
+    parser.add_argument('--archive', metavar='DIR',
+                        help='archive trades, settlements and balances to '
+                             'Parquet files in DIR, partitioned by product '
+                             'and hour')
+    parser.add_argument('--seed', type=int,
+                        help='derive counter parties from a hash of the '
+                             'trade id and this seed, so restarts, replays '
+                             'and workers assign every trade the same way')
+    args = parser.parse_args()
+
+    if args.backfill and args.fetch == 'async':
+        parser.error('--backfill requires --fetch sync')
+    if args.workers and args.fetch == 'async':
+        parser.error('--workers requires --fetch sync')
+    if args.stream and (args.workers or args.backfill or
+                        args.fetch == 'async'):
+        parser.error('--stream cannot be combined with --workers, '
+                     '--backfill or --fetch async')
+
+    if args.horizons and (args.workers or args.stream):
+        parser.error('--horizons cannot be combined with --workers or '
+                     '--stream')
+    if args.horizons and max(args.horizons) > args.window:
+        parser.error('--horizons must not exceed --window')
+    if args.replay and (args.stream or args.workers or args.backfill or
+                        args.horizons or args.fetch == 'async'):
+        parser.error('--replay cannot be combined with --stream, --workers, '
+                     '--backfill, --horizons or --fetch async')
+
+    if args.stream:
+        from feed import StreamingSettlement, websocket_feed, replay_feed
+    if args.replay:
+        from replay import Replay, load_recording
+    if args.archive:
+        from archive import Archive
+
+    engines = {}
+    horizons = {}
+
+    # With workers, each worker archives its own trades and this process
+    # archives settlements and balances
+    archive = Archive(args.archive) if args.archive else None
+
+    if args.metrics_port:
+        METRICS.serve(args.metrics_port)
+
+    # Current prices come with the retrieved trades where possible, so the
+    # ticker is only requested for products without new trades
+    tickers = TickerCache(lambda p: ticker_price(p, args.api_url))
+
+    if args.workers:
+        from workers import WorkerPool
+
+        pool = WorkerPool(args.products, args.workers,
+                          n_parties=args.parties, window_size=args.window,
+                          api_url=args.api_url, backfill=args.backfill,
+                          seed=args.seed, archive_path=args.archive)
+
+    elif args.fetch == 'async':
+        from fetcher import AsyncFetcher
+
+        loop = asyncio.new_event_loop()
+        fetcher = loop.run_until_complete(
+            AsyncFetcher(args.api_url).open())
+
+        def fetch(products):
+            with METRICS.stage('fetch'):
+                bodies = loop.run_until_complete(
+                    fetcher.fetch_all(products, tickers=False))
+            batch = {}
+            for p, (body, _) in bodies.items():
+                trades = trades_frame(body)
+                batch[p] = (trades, tickers.price(p, trades))
+            return batch
+
+    elif args.backfill:
+        session = requests.Session()
+
+        def fetch(products):
+            batch = {}
+            for p in products:
+                watermark = engines[p].last_trade_id \
+                    if p in engines else None
+                trades = data_backfill(p, args.window, watermark,
+                                       args.api_url, session)
+                batch[p] = (trades, tickers.price(p, trades))
+            return batch
+
+    else:
+        def fetch(products):
+            batch = {}
+            for p in products:
+                trades = data_retriever(p, args.api_url)
+                batch[p] = (trades, tickers.price(p, trades))
+            return batch
+
     # Loop will run until keyboard interrupt (Ctrl-C)
     try:
-        # Set initial balance for counterparties
-        balances = pd.DataFrame({'party': range(10),
-                                 'initial_balance': 100000,
-                                 'current_balance': 100000}).set_index('party')
-        start_time = time.time()
-
-        # 1st data retrieval
-        trades_BTC = data_retriever('BTC-USD')
-        trades_ETH = data_retriever('ETH-USD')
-
-        # Assign trades to counter parties
-        trades_BTC = parties_assigner(10, trades_BTC)
-        trades_ETH = parties_assigner(10, trades_ETH)
-
-        # Calculate settlements
-        settlements_BTC = settlement_calculator(trades_BTC, 'BTC-USD')
-        settlements_ETH = settlement_calculator(trades_ETH, 'ETH-USD')
-
-        print('The initial settlements:')
-        print(settlements_BTC)
-        print(settlements_ETH)
-
-        # Update the balances with regard to BTC and ETH trades
-        balances = balance_calculator(balances, settlements_BTC)
-        balances = balance_calculator(balances, settlements_ETH)
-
-        print('The initial balances:')
-        print(balances)
-
-        # Trigger execution every preset time interval
-        elapsed_time = time.time() - start_time
-        time.sleep(max(0, 10 - elapsed_time))
-
-        # Iterate executions
-        while True:
-            # The start time for each minutely execution
-            start_time = time.time()
-
-            # Keep old settlements tables
-            settlements_BTC_old = settlements_BTC.copy()
-            settlements_ETH_old = settlements_ETH.copy()
-
-            # Retrieve existing trades up to 1000
-            new_trades_BTC = data_retriever('BTC-USD')
-            new_trades_ETH = data_retriever('ETH-USD')
-
-            # Assign trades to counter parties
-            trades_BTC = parties_assigner(10, trades_BTC, new_trades_BTC)
-            trades_ETH = parties_assigner(10, trades_ETH, new_trades_ETH)
-
-            # Calculate settlements
-            settlements_BTC = settlement_calculator(trades_BTC, 'BTC-USD')
-            settlements_ETH = settlement_calculator(trades_ETH, 'ETH-USD')
-
-            print('The updated settlements:')
-            print(settlements_BTC)
-            print(settlements_ETH)
-
-            # Update the balances with regard to BTC and ETH trades
-            balances = balance_calculator(balances, settlements_BTC,
-                                          settlements_BTC_old)
-            balances = balance_calculator(balances, settlements_ETH,
-                                          settlements_ETH_old)
-
-            print('The updated balances:')
+        # Set initial balance for counterparties, or recover them from the
+        # ledger
+        if args.ledger:
+            ledger = Ledger(args.ledger, n_parties=args.parties,
+                            snapshot_every=args.snapshot_every,
+                            sync=args.ledger_sync)
+            balances = ledger.frame()
+        else:
+            sheet = BalanceSheet(args.parties, args.products,
+                                 initial_balance=100000)
+            balances = sheet.frame()
+
+        settlements = {}
+        scheduler = None
+
+        def stage_settlements(prod_id, settlements, now=None):
+            """
+            Record the product's settlement obligations, in the ledger if
+            one is kept, else staged on the balance sheet until
+            commit_balances, and archive them as of tick time now.
+            """
+            with METRICS.stage('balance', len(settlements)):
+                if args.ledger:
+                    ledger.update(prod_id, settlements.index.values,
+                                  settlements['settlement_obligation'].values)
+                else:
+                    sheet.set(prod_id, settlements.index.values,
+                              settlements['settlement_obligation'].values)
+
+            if archive is not None:
+                archive.add_settlements(prod_id, now or dt.datetime.utcnow(),
+                                        settlements)
+
+        def commit_balances(now=None):
+            """
+            Apply the recorded obligations to the balances, and archive the
+            balances as of tick time now.
+            """
+            with METRICS.stage('commit'):
+                if args.ledger:
+                    balances = ledger.frame()
+                else:
+                    sheet.commit()
+                    balances = sheet.frame()
+
+            if archive is not None:
+                archive.add_balances(now or dt.datetime.utcnow(), balances)
+
+            return balances
+
+        if args.replay:
+            def on_replay_settle(now, prod_id, new_settlements):
+                settlements[prod_id] = new_settlements
+                stage_settlements(prod_id, new_settlements, now)
+
+            def on_replay_tick(now):
+                global balances
+
+                # Once per tick, after every product is staged
+                balances = commit_balances(now)
+
+            # Drive the pipeline through the recording on simulated time
+            trades, tickers = load_recording(args.replay,
+                                             args.replay_tickers)
+            stats = Replay(trades, tickers, on_replay_settle,
+                           n_parties=args.parties, window_size=args.window,
+                           interval=args.interval, seed=args.seed,
+                           archive=archive, on_tick=on_replay_tick).run()
+
+            for prod_id, table in settlements.items():
+                print('The final settlements of %s:' % prod_id)
+                print(table)
+            print('The final balances:')
             print(balances)
 
-            # Trigger execution every preset time interval
-            elapsed_time = time.time() - start_time
-            time.sleep(max(0, 10 - elapsed_time))
+            print('Replayed %d trades over %.0f simulated s in %d ticks in '
+                  '%.2f s: %.0f trades/s.' % (stats['trades'],
+                                              stats['simulated_seconds'],
+                                              stats['ticks'],
+                                              stats['seconds'],
+                                              stats['trades_per_second']))
+
+        elif args.stream:
+            def on_settle(prod_id, new_settlements):
+                print('The settlements of %s:' % prod_id)
+                print(new_settlements)
+
+                now = streaming.last_time if args.feed_file else None
+                settlements[prod_id] = new_settlements
+                stage_settlements(prod_id, new_settlements, now)
+
+            def on_tick():
+                global balances
+
+                # Once per settlement round, after every product is staged
+                now = streaming.last_time if args.feed_file else None
+                balances = commit_balances(now)
+
+                print('The updated balances:')
+                print(balances)
+
+            # Push trades into the settlement state as they arrive, from a
+            # recorded feed or the live websocket feed
+            streaming = StreamingSettlement(
+                args.products, on_settle, n_parties=args.parties,
+                window_size=args.window, interval=args.interval,
+                every_n=args.settle_every_trades,
+                event_time=args.feed_file is not None, seed=args.seed,
+                archive=archive, on_tick=on_tick)
+            if args.feed_file:
+                source = replay_feed(args.feed_file, args.replay_speed)
+            else:
+                source = websocket_feed(args.products)
+
+            asyncio.new_event_loop().run_until_complete(
+                streaming.run(source))
+
+            print('Received %d trades in %d settlements, max queue depth '
+                  '%d, blocked %.3f s.' % (streaming.n_received,
+                                          streaming.n_settlements,
+                                          streaming.max_depth,
+                                          streaming.blocked_seconds))
+
+        else:
+            # Trigger execution every preset time interval, on fixed deadlines
+            scheduler = TickScheduler(args.interval, policy=args.overrun)
+
+            # Iterate executions
+            for tick in scheduler:
+                stage = 'updated' if settlements else 'initial'
+
+                if args.workers:
+                    # Workers settle their products in parallel and only
+                    # ship back per-party window sums, which give the same
+                    # settlements table as the other modes
+                    for prod_id, (notional, quantity, traded, price,
+                                  n_new) in pool.tick().items():
+                        if stage == 'updated' and n_new > 0:
+                            print('Newly added %.2f trades.' % n_new)
+                        party = np.flatnonzero(traded)
+                        settlements[prod_id] = settlement_table(
+                            prod_id, party, notional[party], quantity[party],
+                            price)
+
+                else:
+                    # Retrieve latest trades and ticker price of every
+                    # product
+                    batch = fetch(args.products)
+
+                    for prod_id in args.products:
+                        new_trades, price = batch[prod_id]
+
+                        # Each product's trades live in the store of its
+                        # engine, which keeps running VWAP sums of the trades
+                        # inside the settlement window
+                        if prod_id not in engines:
+                            engines[prod_id] = SettlementEngine(
+                                prod_id, n_parties=args.parties,
+                                window_size=args.window)
+
+                        settlements[prod_id], n_new = settle_product(
+                            engines[prod_id], new_trades, price,
+                            args.parties, seed=args.seed, archive=archive)
+                        if stage == 'updated' and n_new > 0:
+                            print('Newly added %.2f trades.' % n_new)
+
+                        # Settlement prices over the extra horizons, from
+                        # the trades already in the engine's store
+                        if args.horizons:
+                            if prod_id not in horizons:
+                                horizons[prod_id] = MultiWindowVWAP(
+                                    prod_id, engines[prod_id].store,
+                                    args.parties)
+                            for window_size, table in horizons[prod_id] \
+                                    .settlements(args.horizons,
+                                                 price).items():
+                                print('The settlements of %s over %d s:'
+                                      % (prod_id, window_size))
+                                print(table)
+
+                print('The %s settlements:' % stage)
+
+                for prod_id in args.products:
+                    print(settlements[prod_id])
+                    stage_settlements(prod_id, settlements[prod_id])
+
+                # Apply the obligations of all products to the balances in
+                # one update
+                balances = commit_balances()
+
+                print('The %s balances:' % stage)
+                print(balances)
+
+                if args.metrics_every and \
+                        (tick + 1) % args.metrics_every == 0:
+                    print('Stage latency: ' + METRICS.log_line())
 
     except KeyboardInterrupt:
-        pass
+        if scheduler is not None:
+            print('Tick schedule:')
+            print(scheduler.summary())
+
+    finally:
+        if args.workers:
+            pool.close()
+        if args.fetch == 'async':
+            loop.run_until_complete(fetcher.close())
+        if args.ledger:
+            ledger.close()
+        if archive is not None:
+            archive.close()
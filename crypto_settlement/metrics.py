@@ -0,0 +1,156 @@
+import collections
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import numpy as np
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class StageTimer(object):
+    """
+    Context manager timing one run of a pipeline stage. Set the rows
+    attribute inside the block to count the rows the stage handled.
+    """
+
+    def __init__(self, metrics, name, rows=0):
+        self.metrics = metrics
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.start,
+                             self.rows)
+
+
+class Metrics(object):
+    """
+    Per-stage latency histograms and row counters of the settlement
+    pipeline.
+
+    Each stage keeps cumulative Prometheus style buckets plus the latest
+    samples in a rolling window for percentiles, and the totals can be
+    exposed as Prometheus text over HTTP or printed as a compact log line.
+    """
+
+    def __init__(self, window=1000):
+        """
+        args:
+            window: number of latest samples per stage kept for percentiles
+        """
+        self.window = window
+        self.lock = threading.Lock()
+        self.stages = collections.OrderedDict()
+
+    def stage(self, name, rows=0):
+        """
+        Time a stage:
+
+            with METRICS.stage('decode') as stage:
+                ...
+                stage.rows = len(df)
+        """
+        return StageTimer(self, name, rows)
+
+    def observe(self, name, seconds, rows=0):
+        """
+        Record one run of a stage.
+
+        args:
+            name: stage name
+            seconds: latency of the run
+            rows: number of rows handled by the run
+        """
+        with self.lock:
+            if name not in self.stages:
+                self.stages[name] = {
+                    'buckets': np.zeros(len(BUCKETS), dtype=np.int64),
+                    'count': 0, 'sum': 0.0, 'rows': 0,
+                    'recent': collections.deque(maxlen=self.window)}
+            stage = self.stages[name]
+
+            stage['buckets'][np.searchsorted(BUCKETS, seconds):] += 1
+            stage['count'] += 1
+            stage['sum'] += seconds
+            stage['rows'] += rows
+            stage['recent'].append(seconds)
+
+    def prometheus_text(self):
+        """
+        The metrics in Prometheus text exposition format.
+        """
+        lines = ['# TYPE settlement_stage_seconds histogram']
+        with self.lock:
+            for name, stage in self.stages.items():
+                for le, n in zip(BUCKETS, stage['buckets']):
+                    lines.append('settlement_stage_seconds_bucket{stage="%s",'
+                                 'le="%g"} %d' % (name, le, n))
+                lines.append('settlement_stage_seconds_bucket{stage="%s",'
+                             'le="+Inf"} %d' % (name, stage['count']))
+                lines.append('settlement_stage_seconds_sum{stage="%s"} %.6f'
+                             % (name, stage['sum']))
+                lines.append('settlement_stage_seconds_count{stage="%s"} %d'
+                             % (name, stage['count']))
+
+            lines.append('# TYPE settlement_stage_rows_total counter')
+            for name, stage in self.stages.items():
+                lines.append('settlement_stage_rows_total{stage="%s"} %d'
+                             % (name, stage['rows']))
+
+        return '\n'.join(lines) + '\n'
+
+    def log_line(self):
+        """
+        One compact line with p50/p99 latency in ms and row totals of every
+        stage, over the rolling window.
+        """
+        parts = []
+        with self.lock:
+            for name, stage in self.stages.items():
+                p50, p99 = np.percentile(stage['recent'], [50, 99]) * 1000
+                parts.append('%s p50=%.1fms p99=%.1fms rows=%d'
+                             % (name, p50, p99, stage['rows']))
+
+        return ' | '.join(parts)
+
+    def serve(self, port, host='127.0.0.1'):
+        """
+        Expose the metrics at http://host:port/metrics from a daemon thread.
+
+        return: the HTTP server, call shutdown() on it to stop
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer((host, port), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        return server
+
+
+# Metrics of the settlement pipeline in this process
+METRICS = Metrics()
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+
+def net_positions(long, short, worth, size, n_parties=None):
+    """
+    Net the notional and quantity of each party over a block of trades with
+    scatter-adds into fixed-size arrays.
+
+    Party ids are dense integers, so a single np.bincount over the long and
+    short sides together replaces the groupby / subtract / index alignment of
+    pandas. Parties that only appear on one side get their one-sided totals
+    instead of NaN.
+
+    args:
+        long: int array of long side parties
+        short: int array of short side parties
+        worth: float array of trade worth (price * size)
+        size: float array of trade quantities
+        n_parties: length of the output arrays, defaults to the largest party
+        id + 1
+
+    return: notional, quantity and trade count arrays indexed by party id
+    """
+    if n_parties is None:
+        n_parties = int(max(long.max(initial=-1), short.max(initial=-1))) + 1
+
+    # Long side adds, short side subtracts
+    party = np.concatenate([long, short])
+
+    notional = np.bincount(party, np.concatenate([worth, -worth]), n_parties)
+    quantity = np.bincount(party, np.concatenate([size, -size]), n_parties)
+    n_trades = np.bincount(party, minlength=n_parties)
+
+    return notional, quantity, n_trades
+
+
+def settlement_table(prod_id, party, notional, quantity, current_price):
+    """
+    Build the settlements table from netted positions.
+
+    args:
+        prod_id: the product id, eg. BTC-USD, ETH-USD
+        party: int array of the parties to report
+        notional: net notional of each reported party
+        quantity: net quantity of each reported party
+        current_price: latest trade price of the product
+
+    return: settlements table which has settlement information of each party.
+    """
+    # Calculate volume-weighted average price settlement value
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vwap_value = notional / quantity
+
+    settlements = pd.DataFrame({'vwap_value': vwap_value},
+                               index=pd.Index(party, name='party'))
+
+    # Assign currency USD
+    settlements['currency'] = prod_id[-3:]
+
+    # Insert total quantity calculated earlier
+    settlements['quantity'] = quantity
+
+    settlements['current_price'] = float(current_price)
+
+    # Calculate settlement obligation of each party
+    settlements['settlement_obligation'] = (settlements['vwap_value'] -
+                                            settlements['current_price']) * \
+                                           settlements['quantity']
+
+    return settlements
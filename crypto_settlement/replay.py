@@ -0,0 +1,213 @@
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from main import iso_parser, settle_product
+from settlement_engine import SettlementEngine
+
+
+def read_records(path):
+    """
+    Read recorded records from a JSONL file, one record per line, or from a
+    Parquet file. Parquet files need the pyarrow package.
+
+    args:
+        path: path of a .jsonl or .parquet file
+
+    return: DataFrame of the records
+    """
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        return pq.read_table(path).to_pandas()
+
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+
+    return pd.DataFrame(records)
+
+
+def time_column(values):
+    """
+    Recorded times as datetime64[ns], from ISO strings or timestamps.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        if getattr(values.dt, 'tz', None) is not None:
+            values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+        return values.astype('datetime64[ns]')
+
+    return iso_parser(values.astype(str))
+
+
+def load_recording(path, tickers_path=None):
+    """
+    Load recorded trades and ticker prices.
+
+    Trades need product_id, trade_id, time, price and size fields, as in the
+    match messages of the feed. Records with a type field other than match
+    are dropped, except ticker records, which give the ticker price of a
+    product at a time along with trades in the same file. Tickers can also
+    come from a separate file with product_id, time and price fields.
+
+    args:
+        path: JSONL or Parquet file of recorded trades
+        tickers_path: optional JSONL or Parquet file of recorded tickers
+
+    return: trades and tickers tables, both sorted by time
+    """
+    records = read_records(path)
+
+    tickers = None
+    if 'type' in records:
+        tickers = records[records['type'] == 'ticker']
+        records = records[records['type'] == 'match']
+    if tickers_path is not None:
+        tickers = pd.concat([tickers, read_records(tickers_path)])
+
+    trades = pd.DataFrame({
+        'product_id': records['product_id'].values,
+        'trade_id': records['trade_id'].values.astype(np.int64),
+        'time': time_column(records['time']).values,
+        'price': records['price'].values.astype(float),
+        'size': records['size'].values.astype(float)})
+
+    if tickers is None or len(tickers) == 0:
+        tickers = pd.DataFrame({'product_id': [], 'price': [],
+                                'time': np.array([], 'datetime64[ns]')})
+    else:
+        tickers = pd.DataFrame({
+            'product_id': tickers['product_id'].values,
+            'time': time_column(tickers['time']).values,
+            'price': tickers['price'].values.astype(float)})
+
+    return (trades.sort_values('time', kind='stable', ignore_index=True),
+            tickers.sort_values('time', kind='stable', ignore_index=True))
+
+
+class Replay(object):
+    """
+    Backtest the settlement pipeline on recorded trades.
+
+    The recording is settled on simulated time: every tick advances the
+    clock by interval seconds of recorded time, hands the trades recorded
+    since the previous tick to each product's settlement engine, the way a
+    poll of the trades endpoint would, and settles at the ticker price
+    recorded last before the tick, or the price of the latest trade when no
+    ticker is recorded. Nothing waits on the wall clock, so a day of trading
+    replays as fast as the pipeline runs.
+    """
+
+    def __init__(self, trades, tickers, on_settle=None, n_parties=10,
+                 window_size=3600, interval=10, rng=None, seed=None,
+                 archive=None, on_tick=None):
+        """
+        args:
+            trades: recorded trades table, as returned by load_recording
+            tickers: recorded tickers table, as returned by load_recording
+            on_settle: called with (tick time, prod_id, settlements table)
+            after each settlement of a product
+            n_parties: total number of counter parties
+            window_size: settlement window size in seconds
+            interval: simulated seconds between ticks
+            rng: optional numpy Generator used to assign the parties
+            seed: run seed to hash the parties from the trade ids, None to
+            draw them with rng
+            archive: optional Archive the settled trades are written to
+            on_tick: called with the tick time once every product of the
+            tick is settled
+        """
+        self.on_settle = on_settle
+        self.on_tick = on_tick
+        self.n_parties = n_parties
+        self.interval = interval
+        self.rng = rng
+        self.seed = seed
+        self.archive = archive
+
+        self.trades = {}
+        for prod_id, group in trades.groupby('product_id', sort=False):
+            self.trades[prod_id] = (
+                group['time'].values.astype(np.int64),
+                group.set_index('trade_id')[['time', 'price', 'size']])
+
+        self.tickers = {}
+        for prod_id, group in tickers.groupby('product_id', sort=False):
+            self.tickers[prod_id] = (group['time'].values.astype(np.int64),
+                                     group['price'].values)
+
+        self.engines = {p: SettlementEngine(p, n_parties=n_parties,
+                                            window_size=window_size)
+                        for p in self.trades}
+
+        self.start = int(trades['time'].values.astype(np.int64).min()) \
+            if len(trades) > 0 else 0
+        self.end = int(trades['time'].values.astype(np.int64).max()) \
+            if len(trades) > 0 else 0
+
+    def price(self, prod_id, now, trades, hi):
+        """
+        Recorded ticker price of a product at simulated time now, falling
+        back to the price of its latest trade.
+        """
+        if prod_id in self.tickers:
+            times, prices = self.tickers[prod_id]
+            i = np.searchsorted(times, now, side='right')
+            if i > 0:
+                return float(prices[i - 1])
+
+        return float(trades['price'].values[hi - 1]) if hi > 0 else None
+
+    def run(self):
+        """
+        Replay the whole recording.
+
+        return: dict with the number of trades, ticks and settlements, the
+        simulated and wall seconds, and the trades per second throughput
+        """
+        step = int(self.interval * 1e9)
+        positions = {p: 0 for p in self.trades}
+        n_trades = n_ticks = n_settlements = 0
+
+        start = time.perf_counter()
+
+        now = self.start
+        while True:
+            for prod_id, (times, trades) in self.trades.items():
+                lo = positions[prod_id]
+                hi = np.searchsorted(times, now, side='right')
+                positions[prod_id] = hi
+
+                price = self.price(prod_id, now, trades, hi)
+                if price is None:
+                    continue
+
+                # Newest first, like a page of the trades endpoint
+                new_trades = trades.iloc[lo:hi].iloc[::-1]
+                settlements, n_new = settle_product(
+                    self.engines[prod_id], new_trades, price, self.n_parties,
+                    self.rng, np.datetime64(now, 'ns'), self.seed,
+                    self.archive)
+                n_trades += n_new
+                n_settlements += 1
+
+                if self.on_settle is not None:
+                    self.on_settle(np.datetime64(now, 'ns'), prod_id,
+                                   settlements)
+
+            if self.on_tick is not None:
+                self.on_tick(np.datetime64(now, 'ns'))
+
+            n_ticks += 1
+            if now >= self.end:
+                break
+            now += step
+
+        seconds = time.perf_counter() - start
+
+        return {'trades': n_trades, 'ticks': n_ticks,
+                'settlements': n_settlements,
+                'simulated_seconds': (now - self.start) / 1e9,
+                'seconds': seconds,
+                'trades_per_second': n_trades / seconds if seconds else 0.0}
@@ -0,0 +1,128 @@
+import collections
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TickRecord = collections.namedtuple(
+    'TickRecord', ['index', 'deadline', 'lateness', 'duration', 'skipped'])
+
+
+class TickScheduler(object):
+    """
+    Drift-free fixed-rate tick scheduler.
+
+    Ticks fire on absolute deadlines start + k * interval of the monotonic
+    clock, so the time spent in a tick never shifts the later ones. When a
+    tick overruns past one or more deadlines, the policy decides what
+    happens to them:
+
+        skip: drop the missed deadlines and wait for the next one
+        catchup: run the missed ticks back to back until on schedule again
+        coalesce: run one tick right away for all missed deadlines
+
+    Lateness (start after deadline) and duration of every tick are recorded
+    so the cadence can be checked under load. Only a tick whose own
+    duration runs past the next deadline counts as an overrun; the catch-up
+    and coalesced ticks that start after their deadline are counted as late
+    instead.
+
+    Iterate over the scheduler to run the ticks:
+
+        for tick in TickScheduler(10):
+            ...
+    """
+
+    POLICIES = ('skip', 'catchup', 'coalesce')
+
+    def __init__(self, interval, policy='skip', history=10000,
+                 clock=time.monotonic, sleep=time.sleep):
+        """
+        args:
+            interval: seconds between deadlines
+            policy: overrun policy, one of skip, catchup and coalesce
+            history: number of tick records kept
+            clock: monotonic clock returning seconds
+            sleep: function sleeping for given seconds
+        """
+        if policy not in self.POLICIES:
+            raise ValueError('Unknown overrun policy: %s' % policy)
+
+        self.interval = interval
+        self.policy = policy
+        self.clock = clock
+        self.sleep = sleep
+        self.records = collections.deque(maxlen=history)
+        self.n_ticks = 0
+        self.n_overruns = 0
+        self.n_late = 0
+        self.n_skipped = 0
+
+    def __iter__(self):
+        deadline = self.clock()
+
+        while True:
+            now = self.clock()
+            if deadline > now:
+                self.sleep(deadline - now)
+                now = self.clock()
+            elif self.n_ticks > 0:
+                # Deadline already passed: a catch-up or coalesced tick
+                self.n_late += 1
+
+            yield self.n_ticks
+
+            end = self.clock()
+            self.n_ticks += 1
+            skipped = 0
+
+            next_deadline = deadline + self.interval
+            if end > next_deadline:
+                # Number of deadlines already passed
+                missed = int((end - next_deadline) // self.interval) + 1
+
+                if self.policy == 'skip':
+                    skipped = missed
+                elif self.policy == 'coalesce':
+                    skipped = missed - 1
+
+                # A tick starting after the next deadline only overran if
+                # it took longer than an interval itself
+                overrun = end - next_deadline if now <= next_deadline \
+                    else end - now - self.interval
+                if overrun > 0:
+                    self.n_overruns += 1
+                    logger.warning('Tick %d overran by %.3f s, %d '
+                                   'deadline(s) skipped.', self.n_ticks - 1,
+                                   overrun, skipped)
+
+            self.n_skipped += skipped
+            self.records.append(TickRecord(self.n_ticks - 1, deadline,
+                                           now - deadline, end - now,
+                                           skipped))
+
+            deadline = next_deadline + skipped * self.interval
+
+    def summary(self):
+        """
+        Summary statistics of the recorded ticks.
+
+        return: dict of tick, overrun, late and skipped counts, and
+        lateness and duration percentiles in seconds
+        """
+        summary = {'ticks': self.n_ticks, 'overruns': self.n_overruns,
+                   'late': self.n_late, 'skipped': self.n_skipped}
+
+        if self.records:
+            lateness = np.array([r.lateness for r in self.records])
+            duration = np.array([r.duration for r in self.records])
+            for name, values in [('lateness', lateness),
+                                 ('duration', duration)]:
+                p50, p99 = np.percentile(values, [50, 99])
+                summary[name + '_p50'] = float(p50)
+                summary[name + '_p99'] = float(p99)
+                summary[name + '_max'] = float(values.max())
+
+        return summary
@@ -0,0 +1,241 @@
+import numpy as np
+import datetime as dt
+
+from trade_store import TradeStore
+from netting import net_positions, settlement_table
+
+
+class SettlementEngine(object):
+    """
+    Incremental sliding-window settlement engine for a single product.
+
+    The engine keeps running per-party sums of notional (price * size) and
+    quantity for the trades inside the moving window. Each update only adds
+    the newly arrived trades and subtracts the trades that fell out of the
+    window, so the cost of a tick is proportional to new + expired trades
+    instead of the whole trade history. The trades themselves live in a
+    TradeStore whose window start follows the engine's window.
+    """
+
+    def __init__(self, prod_id, n_parties=10, window_size=3600, store=None):
+        """
+        args:
+            prod_id: the product id, eg. BTC-USD, ETH-USD
+            n_parties: initial number of counter parties, grown on demand
+            window_size: the moving window size (in seconds) used to
+            calculate volume weighted average price.
+            store: TradeStore holding the product's trades, a new one is
+            created if not given
+        """
+        self.prod_id = prod_id
+        self.window_size = window_size
+        self.store = TradeStore() if store is None else store
+
+        # Per-party running sums over the trades inside the window
+        self.notional = np.zeros(n_parties)
+        self.quantity = np.zeros(n_parties)
+        self.n_trades = np.zeros(n_parties, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.store)
+
+    @property
+    def last_trade_id(self):
+        return self.store.last_trade_id
+
+    def _grow(self, n_parties):
+        """
+        Grow the per-party arrays so party ids below n_parties fit.
+        """
+        extra = n_parties - len(self.notional)
+        if extra > 0:
+            self.notional = np.concatenate([self.notional, np.zeros(extra)])
+            self.quantity = np.concatenate([self.quantity, np.zeros(extra)])
+            self.n_trades = np.concatenate([self.n_trades,
+                                            np.zeros(extra, dtype=np.int64)])
+
+    def _scatter(self, long, short, worth, size, sign):
+        """
+        Add (sign=1) or remove (sign=-1) trades from the running sums.
+        """
+        notional, quantity, n_trades = net_positions(long, short, worth, size,
+                                                     len(self.notional))
+        self.notional += sign * notional
+        self.quantity += sign * quantity
+        self.n_trades += sign * n_trades
+
+    def add_trades(self, trades):
+        """
+        Add newly arrived trades to the store and the window sums. Trades
+        whose trade_id is not above the last one stored are ignored, so the
+        whole accumulated table can be passed in without double counting.
+
+        args:
+            trades: trades table indexed by trade_id with time, price, size,
+            long and short columns.
+
+        return: number of trades added
+        """
+        new = trades.index.values.astype(np.int64) > self.last_trade_id
+        if not new.any():
+            return 0
+
+        trades = trades[new]
+        long = trades['long'].values.astype(np.int32)
+        short = trades['short'].values.astype(np.int32)
+        price = trades['price'].values.astype(np.float64, copy=False)
+        size = trades['size'].values.astype(np.float64, copy=False)
+
+        self._grow(max(long.max(), short.max()) + 1)
+        self._scatter(long, short, price * size, size, 1)
+
+        return self.store.append(
+            trades.index.values,
+            trades['time'].values.astype('datetime64[ns]').view(np.int64),
+            price, size, long, short)
+
+    def evict(self, now=None):
+        """
+        Remove the trades that are no longer inside the window ending at now.
+
+        args:
+            now: end of the window, defaults to current UTC time
+
+        return: number of trades evicted
+        """
+        if now is None:
+            now = dt.datetime.utcnow()
+        cutoff = np.datetime64(now, 'ns').astype(np.int64) - \
+            int(self.window_size * 1e9)
+
+        # The window keeps trades strictly later than the cutoff
+        lo, hi = self.store.advance(cutoff)
+        if hi == lo:
+            return 0
+
+        rows = self.store.rows(lo, hi)
+        self._scatter(rows['long'], rows['short'],
+                      rows['price'] * rows['size'], rows['size'], -1)
+
+        # Parties left without trades get rid of their rounding residue
+        idle = self.n_trades == 0
+        self.notional[idle] = 0
+        self.quantity[idle] = 0
+
+        return hi - lo
+
+    def settlements(self, current_price, now=None):
+        """
+        Evict expired trades and build the settlements table from the
+        running sums, in the same layout as settlement_calculator.
+
+        args:
+            current_price: latest trade price of the product
+            now: end of the window, defaults to current UTC time
+
+        return: settlements table which has settlement information of each
+        party.
+        """
+        self.evict(now)
+
+        party = np.flatnonzero(self.n_trades)
+
+        return settlement_table(self.prod_id, party, self.notional[party],
+                                self.quantity[party], current_price)
+
+
+class MultiWindowVWAP(object):
+    """
+    Settlements of one product over several window sizes from one pass.
+
+    Windows ending at the same time are nested, so the trades of a window
+    are those of the next shorter window plus a ring of older trades. Each
+    ring is netted once with a bincount and added to the totals of the
+    shorter window, so all window sizes together cost a single pass over
+    the longest window, with no sorting.
+    """
+
+    def __init__(self, prod_id, store, n_parties=None):
+        """
+        args:
+            prod_id: the product id, eg. BTC-USD, ETH-USD
+            store: TradeStore holding the product's trades; it has to retain
+            the longest window asked for
+            n_parties: number of counter parties, defaults to the largest
+            party id in the longest window + 1
+        """
+        self.prod_id = prod_id
+        self.store = store
+        self.n_parties = n_parties
+
+    def totals(self, cutoffs):
+        """
+        Per-party totals over the trades strictly later than each cutoff.
+
+        args:
+            cutoffs: int64 timestamps in nanoseconds
+
+        return: list of (notional, quantity, trade count) arrays indexed by
+        party id, one per cutoff
+        """
+        cutoffs = np.asarray(cutoffs, dtype=np.int64)
+        columns = {name: self.store.column(name)
+                   for name in ('time', 'price', 'size', 'long', 'short')}
+        first = np.searchsorted(columns['time'], cutoffs, side='right')
+
+        n_parties = self.n_parties
+        if n_parties is None:
+            lo = int(first.min(initial=len(columns['time'])))
+            n_parties = int(max(columns['long'][lo:].max(initial=-1),
+                                columns['short'][lo:].max(initial=-1))) + 1
+
+        notional = np.zeros(n_parties)
+        quantity = np.zeros(n_parties)
+        n_trades = np.zeros(n_parties, dtype=np.int64)
+
+        # From the shortest window to the longest, netting one ring each
+        results = [None] * len(cutoffs)
+        hi = len(columns['time'])
+        for i in np.argsort(first, kind='stable')[::-1]:
+            lo = int(first[i])
+            if lo < hi:
+                size = columns['size'][lo:hi]
+                ring = net_positions(columns['long'][lo:hi],
+                                     columns['short'][lo:hi],
+                                     columns['price'][lo:hi] * size, size,
+                                     n_parties)
+                notional += ring[0]
+                quantity += ring[1]
+                n_trades += ring[2]
+                hi = lo
+            results[i] = (notional.copy(), quantity.copy(), n_trades.copy())
+
+        return results
+
+    def settlements(self, window_sizes, current_price, now=None):
+        """
+        Settlements tables for several window sizes.
+
+        args:
+            window_sizes: list of window sizes in seconds
+            current_price: latest trade price of the product
+            now: end of the windows, defaults to current UTC time
+
+        return: dict mapping window size to settlements table
+        """
+        if now is None:
+            now = dt.datetime.utcnow()
+        now = np.datetime64(now, 'ns').astype(np.int64)
+
+        totals = self.totals([now - int(window_size * 1e9)
+                              for window_size in window_sizes])
+
+        results = {}
+        for window_size, (notional, quantity, n_trades) in zip(window_sizes,
+                                                               totals):
+            party = np.flatnonzero(n_trades)
+            results[window_size] = settlement_table(
+                self.prod_id, party, notional[party], quantity[party],
+                current_price)
+
+        return results
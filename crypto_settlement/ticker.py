@@ -0,0 +1,110 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def newest_price(trades):
+    """
+    Price of the newest trade in a trades table indexed by trade_id, None if
+    the table is empty.
+    """
+    if trades is None or len(trades) == 0:
+        return None
+
+    return float(trades['price'].values[np.argmax(trades.index.values)])
+
+
+class TickerCache(object):
+    """
+    Shared cache of the current price of every product.
+
+    The ticker reports the price of the latest trade, so a price seen in a
+    freshly retrieved trade batch is taken as is and no request is needed.
+    Otherwise a cached price is served for ttl seconds. Concurrent lookups
+    of the same product while a request is in flight wait for that request
+    instead of sending their own, and when a request fails the last known
+    price is served, however old, as long as there is one.
+    """
+
+    def __init__(self, fetch, ttl=2.0, clock=time.monotonic):
+        """
+        args:
+            fetch: function retrieving the ticker price of a product ID,
+            eg. ticker_price
+            ttl: seconds a price is served before it is retrieved again
+            clock: monotonic clock returning seconds
+        """
+        self.fetch = fetch
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.prices = {}
+        self.in_flight = {}
+
+        self.n_requests = 0
+        self.n_hits = 0
+        self.n_fallbacks = 0
+
+    def observe(self, prod_id, price):
+        """
+        Record the price of the newest trade of a product.
+        """
+        with self.lock:
+            self.prices[prod_id] = (float(price), self.clock())
+
+    def price(self, prod_id, trades=None):
+        """
+        Current price of a product.
+
+        args:
+            prod_id: product ID, eg. BTC-USD, ETH-USD
+            trades: optional batch of new trades of the product, indexed by
+            trade_id; the price of its newest trade is the current price
+
+        return: current price as float
+        """
+        latest = newest_price(trades)
+        if latest is not None:
+            self.observe(prod_id, latest)
+            return latest
+
+        with self.lock:
+            cached = self.prices.get(prod_id)
+            if cached is not None and self.clock() - cached[1] < self.ttl:
+                self.n_hits += 1
+                return cached[0]
+
+            future = self.in_flight.get(prod_id)
+            owner = future is None
+            if owner:
+                future = self.in_flight[prod_id] = Future()
+                self.n_requests += 1
+
+        if owner:
+            try:
+                price = float(self.fetch(prod_id))
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                self.observe(prod_id, price)
+                future.set_result(price)
+            finally:
+                with self.lock:
+                    del self.in_flight[prod_id]
+
+        try:
+            return future.result()
+        except Exception:
+            if cached is None:
+                raise
+            logger.warning('Ticker of %s failed, using the price from '
+                           '%.1f s ago.', prod_id,
+                           self.clock() - cached[1])
+            with self.lock:
+                self.n_fallbacks += 1
+            return cached[0]
@@ -0,0 +1,198 @@
+import numpy as np
+
+
+class TradeStore(object):
+    """
+    Compact append-only columnar store of one product's trades.
+
+    Trades are kept in preallocated NumPy arrays ordered by time: int64
+    trade_id, int64 nanosecond timestamps, float64 price and size, and int32
+    long and short party ids. Appends are amortized O(1) (capacity doubles
+    when full), the start of the live window is a moving pointer, and rows
+    that fell out of the window are dropped by periodic compaction, so memory
+    stays bounded by the longest settlement window instead of growing for as
+    long as the process runs.
+
+    The arrays returned by window() and column() are views into the store;
+    they stay valid until the next append.
+    """
+
+    FIELDS = (('trade_id', np.int64),
+              ('time', np.int64),
+              ('price', np.float64),
+              ('size', np.float64),
+              ('long', np.int32),
+              ('short', np.int32))
+
+    def __init__(self, capacity=1024):
+        """
+        args:
+            capacity: initial number of rows preallocated, at least 1 so
+            that doubling can grow it
+        """
+        capacity = max(1, capacity)
+        self._columns = {name: np.empty(capacity, dtype=dtype)
+                         for name, dtype in self.FIELDS}
+        self.start = 0
+        self.end = 0
+        self.last_trade_id = -1
+
+    def __len__(self):
+        return self.end - self.start
+
+    @property
+    def capacity(self):
+        return len(self._columns['trade_id'])
+
+    def column(self, name, lo=None):
+        """
+        View of one column from row lo (default: the window start) to the
+        last row.
+        """
+        if lo is None:
+            lo = self.start
+
+        return self._columns[name][lo:self.end]
+
+    def _reserve(self, n):
+        """
+        Make room for n more rows, compacting away evicted rows first and
+        doubling the capacity if that is not enough.
+        """
+        if self.end + n <= self.capacity:
+            return
+
+        live = self.end - self.start
+        capacity = self.capacity
+        while live + n > capacity:
+            capacity *= 2
+
+        for name, dtype in self.FIELDS:
+            old = self._columns[name]
+            new = old if capacity == len(old) else \
+                np.empty(capacity, dtype=dtype)
+            new[:live] = old[self.start:self.end]
+            self._columns[name] = new
+
+        self.start = 0
+        self.end = live
+
+    def append(self, trade_id, time, price, size, long, short):
+        """
+        Append a batch of trades.
+
+        Trades with a trade_id not above last_trade_id are ignored. Trades
+        older than the newest stored one are merged into time order, which
+        only touches the live window.
+
+        args:
+            trade_id: int array of trade ids
+            time: int64 array of timestamps in nanoseconds
+            price: float array of trade prices
+            size: float array of trade quantities
+            long: int array of long side parties
+            short: int array of short side parties
+
+        return: number of trades appended
+        """
+        trade_id = np.asarray(trade_id, dtype=np.int64)
+        new = trade_id > self.last_trade_id
+        if not new.any():
+            return 0
+
+        batch = {'trade_id': trade_id, 'time': time, 'price': price,
+                 'size': size, 'long': long, 'short': short}
+        batch = {k: np.asarray(v)[new] for k, v in batch.items()}
+
+        order = np.argsort(batch['time'], kind='stable')
+        n = len(order)
+
+        self._reserve(n)
+        lo, hi = self.end, self.end + n
+        for name, _ in self.FIELDS:
+            self._columns[name][lo:hi] = batch[name][order]
+        self.end = hi
+        self.last_trade_id = max(self.last_trade_id,
+                                 int(batch['trade_id'].max()))
+
+        time = self._columns['time']
+        if lo > self.start and time[lo - 1] > time[lo]:
+            # Late trades: restore time order of the live window
+            order = np.argsort(time[self.start:hi], kind='stable')
+            for name, _ in self.FIELDS:
+                column = self._columns[name]
+                column[self.start:hi] = column[self.start:hi][order]
+
+        return n
+
+    def append_frame(self, trades):
+        """
+        Append a trades table indexed by trade_id with time, price, size,
+        long and short columns.
+        """
+        return self.append(trades.index.values,
+                           trades['time'].values.astype('datetime64[ns]')
+                           .view(np.int64),
+                           trades['price'].values.astype(np.float64,
+                                                         copy=False),
+                           trades['size'].values.astype(np.float64,
+                                                        copy=False),
+                           trades['long'].values.astype(np.int32),
+                           trades['short'].values.astype(np.int32))
+
+    def window_start(self, cutoff):
+        """
+        Position of the first live row strictly later than cutoff.
+
+        args:
+            cutoff: int64 timestamp in nanoseconds
+        """
+        return self.start + int(np.searchsorted(self.column('time'), cutoff,
+                                                side='right'))
+
+    def window(self, cutoff):
+        """
+        Views of all columns for the rows strictly later than cutoff.
+
+        args:
+            cutoff: int64 timestamp in nanoseconds
+
+        return: dict mapping column name to array view
+        """
+        lo = self.window_start(cutoff)
+
+        return {name: self.column(name, lo) for name, _ in self.FIELDS}
+
+    def advance(self, cutoff):
+        """
+        Move the window start past the rows at or before cutoff. The rows
+        stay in memory until the next compaction.
+
+        args:
+            cutoff: int64 timestamp in nanoseconds
+
+        return: positions (lo, hi) of the rows that left the window
+        """
+        lo = self.start
+        self.start = self.window_start(cutoff)
+
+        return lo, self.start
+
+    def rows(self, lo, hi):
+        """
+        Views of all columns for rows lo to hi.
+        """
+        return {name: self._columns[name][lo:hi] for name, _ in self.FIELDS}
+
+    def compact(self):
+        """
+        Drop the rows before the window start, moving the live rows to the
+        front of the arrays.
+        """
+        live = self.end - self.start
+        if self.start > 0:
+            for name, _ in self.FIELDS:
+                column = self._columns[name]
+                column[:live] = column[self.start:self.end]
+        self.start = 0
+        self.end = live
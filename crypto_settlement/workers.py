@@ -0,0 +1,163 @@
+import multiprocessing
+import traceback
+
+import numpy as np
+
+from main import (API_URL, data_retriever, data_backfill, ticker_price,
+                  settle_product)
+from settlement_engine import SettlementEngine
+from ticker import TickerCache
+from archive import Archive
+
+
+def settlement_worker(conn, prod_ids, n_parties, window_size, api_url,
+                      backfill, seed=None, archive_path=None):
+    """
+    Process loop of one settlement worker.
+
+    The worker owns the trade stores and VWAP state of its products. On each
+    tick it retrieves new trades, assigns counter parties, updates the
+    settlement window and sends back only dense per-party notional and
+    quantity vectors per product, from which the coordinator rebuilds the
+    settlements table.
+
+    args:
+        conn: worker end of the pipe to the coordinator
+        prod_ids: product IDs handled by this worker
+        n_parties: total number of counter parties
+        window_size: settlement window size in seconds
+        api_url: base url of the exchange api
+        backfill: retrieve trades with data_backfill instead of a single page
+        seed: run seed to hash the parties from the trade ids, None to draw
+        them at random
+        archive_path: optional directory of an Archive the worker writes its
+        new trades to
+    """
+    archive = Archive(archive_path) if archive_path else None
+    tickers = TickerCache(lambda p: ticker_price(p, api_url))
+    engines = {p: SettlementEngine(p, n_parties=n_parties,
+                                   window_size=window_size)
+               for p in prod_ids}
+
+    # Ctrl-C reaches the whole process group; the coordinator shuts down
+    # the workers itself
+    try:
+        while True:
+            message = conn.recv()
+            if message is None:
+                break
+
+            try:
+                results = {}
+                for prod_id, engine in engines.items():
+                    if backfill:
+                        new_trades = data_backfill(prod_id, window_size,
+                                                   engine.last_trade_id,
+                                                   api_url)
+                    else:
+                        new_trades = data_retriever(prod_id, api_url)
+
+                    price = tickers.price(prod_id, new_trades)
+                    settlements, n_new = settle_product(
+                        engine, new_trades, price, n_parties, seed=seed,
+                        archive=archive)
+
+                    # Window sums of the reported parties, zero elsewhere
+                    party = settlements.index.values
+                    notional = np.zeros(n_parties)
+                    quantity = np.zeros(n_parties)
+                    traded = np.zeros(n_parties, dtype=bool)
+                    notional[party] = engine.notional[party]
+                    quantity[party] = engine.quantity[party]
+                    traded[party] = True
+                    results[prod_id] = (notional, quantity, traded, price,
+                                        n_new)
+
+                conn.send(('ok', results))
+
+            except Exception:
+                conn.send(('error', traceback.format_exc()))
+
+    except KeyboardInterrupt:
+        pass
+
+    if archive is not None:
+        archive.close()
+    conn.close()
+
+
+class WorkerPool(object):
+    """
+    Shard products across settlement worker processes.
+
+    Products are dealt round-robin to the workers, which run their ticks in
+    parallel, so tick latency scales with products per core instead of the
+    total number of products. The coordinator only receives two vectors of
+    n_parties floats and a party mask per product.
+    """
+
+    def __init__(self, prod_ids, n_workers, n_parties=10, window_size=3600,
+                 api_url=API_URL, backfill=False, seed=None,
+                 archive_path=None):
+        """
+        args:
+            prod_ids: product IDs to settle
+            n_workers: number of worker processes, capped at the number of
+            products
+            n_parties: total number of counter parties
+            window_size: settlement window size in seconds
+            api_url: base url of the exchange api
+            backfill: retrieve trades with data_backfill instead of a single
+            page
+            seed: run seed to hash the parties from the trade ids, so every
+            trade gets the same parties whichever worker settles it
+            archive_path: optional directory of an Archive every worker
+            writes its new trades to
+        """
+        self.prod_ids = list(prod_ids)
+        n_workers = max(1, min(n_workers, len(self.prod_ids)))
+
+        self.conns = []
+        self.processes = []
+        for i in range(n_workers):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=settlement_worker,
+                args=(child, self.prod_ids[i::n_workers], n_parties,
+                      window_size, api_url, backfill, seed, archive_path),
+                daemon=True)
+            process.start()
+            child.close()
+            self.conns.append(parent)
+            self.processes.append(process)
+
+    def tick(self):
+        """
+        Run one tick on every worker.
+
+        return: dict mapping product ID to (notional vector, quantity
+        vector, mask of the parties with trades in the window, current
+        price, number of new trades)
+        """
+        for conn in self.conns:
+            conn.send('tick')
+
+        results = {}
+        for conn in self.conns:
+            status, payload = conn.recv()
+            if status == 'error':
+                raise RuntimeError('Settlement worker failed:\n' + payload)
+            results.update(payload)
+
+        return results
+
+    def close(self):
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            conn.close()
+
+        for process in self.processes:
+            process.join(timeout=5)
@@ -0,0 +1,73 @@
+'''
+Benchmark of the content based model: the row by row linear_kernel and
+argsort loop against the blocked top k search of similarity.py.
+
+The descriptions are synthetic text put through the TfidfVectorizer
+of model.py. The row by row loop is timed on a sample of rows and
+extrapolated to the whole catalog. Run from the recommender_system
+directory:
+
+	python benchmarks/content_similarity.py
+	python benchmarks/content_similarity.py --apps 5000 50000 --jobs 1 4
+'''
+
+import argparse
+import os
+import random
+import sys
+import time
+from multiprocessing import cpu_count
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from similarity import top_k_similar
+
+words = ('explore build fight craft survive dungeon story world friends co-op online puzzle strategy ancient city space '
+	'ship hero magic sword legendary battle challenge quest secret island ocean forest epic new modes levels weapons').split()
+
+def tfidf_matrix(n_apps, rng):
+	#tfidf of synthetic descriptions like the one of model.py, or a dense
+	#stand in of normalized random rows without scikit-learn
+	try:
+		from sklearn.feature_extraction.text import TfidfVectorizer
+	except ImportError:
+		matrix = np.random.default_rng(0).random((n_apps, 256)) ** 8
+		return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+	vocabulary = ['%s%d' % (w, i) for w in words for i in range(200)]
+	lst_about_the_game = [' '.join(rng.choice(vocabulary) for _ in range(rng.randint(50, 300))) for _ in range(n_apps)]
+	return TfidfVectorizer(strip_accents='unicode',stop_words='english').fit_transform(lst_about_the_game)
+
+def row_by_row(matrix, rows):
+	#the loop model.py used to run, on some rows only
+	for index in rows:
+		cosine_similarities = matrix[index:index+1] @ matrix.T
+		if hasattr(cosine_similarities, 'toarray'):
+			cosine_similarities = cosine_similarities.toarray()
+		cosine_similarities = cosine_similarities.flatten()
+		cosine_similarities.argsort()[-2:-22:-1]
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark of the content based similarity search.')
+	parser.add_argument('--apps', type=int, nargs='+', default=[5000, 50000], help='numbers of games')
+	parser.add_argument('--jobs', type=int, nargs='+', default=sorted(set([1, cpu_count()])), help='thread pool sizes')
+	parser.add_argument('--sample', type=int, default=200, help='rows timed with the row by row loop')
+	args = parser.parse_args()
+
+	rng = random.Random(0)
+	print('%8s %10s %5s %10s %9s' % ('apps', 'method', 'jobs', 'seconds', 'speedup'))
+	for n_apps in args.apps:
+		matrix = tfidf_matrix(n_apps, rng)
+
+		sample = range(min(args.sample, n_apps))
+		start = time.perf_counter()
+		row_by_row(matrix, sample)
+		baseline = (time.perf_counter() - start) * n_apps / len(sample)
+		print('%8d %10s %5d %10.2f %8.1fx' % (n_apps, 'row', 1, baseline, 1.0))
+
+		for n_jobs in sorted(args.jobs):
+			start = time.perf_counter()
+			top_k_similar(matrix, k=20, n_jobs=n_jobs)
+			seconds = time.perf_counter() - start
+			print('%8d %10s %5d %10.2f %8.1fx' % (n_apps, 'blocked', n_jobs, seconds, baseline / seconds))
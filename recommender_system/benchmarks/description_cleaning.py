@@ -0,0 +1,90 @@
+'''
+Benchmark of the app description cleaning: BeautifulSoup parsing and the
+tag stripping fast path, serially and over process pools of growing size.
+
+The descriptions are synthetic Steam style HTML, as many as the apps in
+game_detail_data.txt and a 50k app catalog by default. Run from the
+recommender_system directory:
+
+	python benchmarks/description_cleaning.py
+	python benchmarks/description_cleaning.py --apps 500 50000 --jobs 1 2 4
+'''
+
+import argparse
+import os
+import random
+import sys
+import time
+from multiprocessing import cpu_count
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from description_cleaning import clean_descriptions, html_to_text, strip_tags
+
+path_game_detail = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'game_detail_data.txt')
+
+words = ('explore build fight craft survive dungeon story world friends co-op online puzzle strategy ancient city space '
+	'ship hero magic sword legendary battle challenge quest secret island ocean forest &amp; &quot;epic&quot; '
+	'new modes levels weapons characters soundtrack').split()
+
+def synthetic_description(rng):
+	#generating an about_the_game field with the usual Steam markup
+	parts = []
+	for _ in range(rng.randint(2, 8)):
+		sentence = ' '.join(rng.choice(words) for _ in range(rng.randint(20, 60)))
+		kind = rng.random()
+		if kind < 0.2:
+			parts.append('<h2 class="bb_tag">%s</h2>' % sentence[:40])
+		elif kind < 0.4:
+			parts.append('<ul class="bb_ul"><li>%s</li><li>%s</li></ul>' % (sentence[:80], sentence[80:]))
+		elif kind < 0.5:
+			parts.append('<img src="https://steamcdn-a.akamaihd.net/steam/apps/%d/extras/a.gif?t=1" >' % rng.randint(10, 900000))
+		else:
+			parts.append('<p><strong>%s</strong><br>\r\n%s<br><br></p>' % (sentence[:30], sentence[30:]))
+	return '\t'.join(parts)
+
+def best_of(func, repeat):
+	#best wall time of func over repeat runs, in seconds
+	best = float('inf')
+	for _ in range(repeat):
+		start = time.perf_counter()
+		func()
+		best = min(best, time.perf_counter() - start)
+	return best
+
+if __name__ == '__main__':
+	with open(path_game_detail) as f:
+		n_game_detail = sum(1 for line in f if line.strip())
+
+	parser = argparse.ArgumentParser(description='Benchmark of the app description cleaning.')
+	parser.add_argument('--apps', type=int, nargs='+', default=[n_game_detail, 50000], help='numbers of descriptions')
+	parser.add_argument('--jobs', type=int, nargs='+', default=sorted(set([1, 2, cpu_count()])), help='process pool sizes')
+	parser.add_argument('--repeat', type=int, default=3, help='timed runs, the best is kept')
+	args = parser.parse_args()
+
+	try:
+		import bs4
+		methods = [('soup', False), ('strip', True)]
+	except ImportError:
+		print('BeautifulSoup is not installed, timing the fast path only.')
+		methods = [('strip', True)]
+
+	rng = random.Random(0)
+	print('%8s %6s %5s %10s %9s %9s' % ('apps', 'method', 'jobs', 'seconds', 'speedup', 'per core'))
+	for n_apps in args.apps:
+		lst_about_the_game = [synthetic_description(rng) for _ in range(n_apps)]
+
+		if len(methods) == 2:
+			#how often the fast path gives the same text as BeautifulSoup
+			sample = lst_about_the_game[:1000]
+			same = sum(html_to_text(x) == strip_tags(x) for x in sample)
+			print('%8d fast path matches BeautifulSoup on %d of %d descriptions' % (n_apps, same, len(sample)))
+
+		serial = None
+		for name, fast in methods:
+			for n_jobs in sorted(args.jobs):
+				seconds = best_of(lambda: clean_descriptions(lst_about_the_game, n_jobs=n_jobs, fast=fast), args.repeat)
+				if serial is None:
+					#speedups are relative to serial BeautifulSoup, or serial stripping without it
+					serial = seconds
+				print('%8d %6s %5d %10.4f %8.1fx %8.2fx' % (n_apps, name, n_jobs, seconds, serial / seconds, serial / seconds / n_jobs))
@@ -0,0 +1,141 @@
+import html
+import re
+from collections import deque
+from functools import partial
+from multiprocessing import cpu_count, get_all_start_methods, get_context
+
+#markup that never shows up as text: tags, comments and doctypes, a tag
+#starting right after the < so that text like 3 < 5 and 7 > 2 is kept
+re_tag = re.compile(r'<!--.*?-->|</?[A-Za-z!?][^>]*>', re.S)
+re_space = re.compile(r'(\s+)')
+
+def html_to_text(about_the_game):
+	'''
+	Clean an app description by parsing its HTML with BeautifulSoup and
+	collapsing the whitespace of the text.
+	'''
+	from bs4 import BeautifulSoup
+	soup = BeautifulSoup(about_the_game,'lxml')
+	return re_space.sub(' ',soup.text).strip()
+
+def strip_tags(about_the_game):
+	'''
+	Fast path of html_to_text: cut the tags out with a regular expression
+	and decode the entities, without building a DOM.
+	'''
+	text = re_tag.sub('',about_the_game)
+	if '&' in text:
+		text = html.unescape(text)
+	return re_space.sub(' ',text).strip()
+
+def clean_chunk(chunk, fast=False):
+	#cleaning one chunk of descriptions in a worker process
+	clean = strip_tags if fast else html_to_text
+	return [clean(about_the_game) for about_the_game in chunk]
+
+def clean_descriptions(lst_about_the_game, n_jobs=None, chunk_size=200, fast=False):
+	'''
+	Clean the HTML descriptions of apps, spread over a process pool.
+
+	The descriptions are sent to the workers in chunks and the results come
+	back in the order of the input.
+
+	args:
+		lst_about_the_game: list of HTML descriptions
+		n_jobs: number of worker processes, all cores by default, 1 to clean
+		in this process
+		chunk_size: number of descriptions per chunk
+		fast: strip the tags with strip_tags instead of parsing the HTML
+
+	return: list of cleaned descriptions
+	'''
+	if n_jobs is None:
+		n_jobs = cpu_count()
+	chunks = [lst_about_the_game[i:i + chunk_size] for i in range(0, len(lst_about_the_game), chunk_size)]
+	if n_jobs == 1 or len(chunks) <= 1:
+		return [text for chunk in chunks for text in clean_chunk(chunk, fast)]
+	#model.py is a script without a main guard, so the workers are forked
+	#instead of started by importing it again
+	context = get_context('fork' if 'fork' in get_all_start_methods() else None)
+	with context.Pool(min(n_jobs, len(chunks))) as pool:
+		return [text for chunk in pool.imap(partial(clean_chunk, fast=fast), chunks) for text in chunk]
+
+class DescriptionCleaner(object):
+	'''
+	Clean app descriptions in a process pool while they are being read.
+
+	Descriptions are sent to the pool a chunk at a time as soon as the chunk
+	is full, and the oldest chunks are collected first, so only a few chunks
+	of raw HTML are held at once and the cleaned texts come out in the order
+	they were added.
+	'''
+
+	def __init__(self, n_jobs=None, chunk_size=200, fast=False):
+		'''
+		args:
+			n_jobs: number of worker processes, all cores by default, 1 to
+			clean in this process
+			chunk_size: number of descriptions per chunk
+			fast: strip the tags with strip_tags instead of parsing the HTML
+		'''
+		if n_jobs is None:
+			n_jobs = cpu_count()
+		self.chunk_size = chunk_size
+		self.fast = fast
+		self.max_pending = 2 * n_jobs
+		self.keys = []
+		self.chunk = []
+		self.pending = deque()
+		self.cleaned = {}
+		self.pool = None
+		if n_jobs > 1:
+			#forking for the same reason as clean_descriptions
+			context = get_context('fork' if 'fork' in get_all_start_methods() else None)
+			self.pool = context.Pool(n_jobs)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		if self.pool is not None:
+			self.pool.terminate()
+			self.pool = None
+
+	def add(self, key, about_the_game):
+		'''
+		Queue the description of an app for cleaning.
+		'''
+		self.keys.append(key)
+		self.chunk.append(about_the_game)
+		if len(self.chunk) >= self.chunk_size:
+			self.submit()
+
+	def submit(self):
+		#sending the current chunk to the pool, or cleaning it here without one
+		if self.chunk:
+			if self.pool is None:
+				self.cleaned.update(zip(self.keys, clean_chunk(self.chunk, self.fast)))
+			else:
+				self.pending.append((self.keys, self.pool.apply_async(clean_chunk, (self.chunk, self.fast))))
+			self.keys = []
+			self.chunk = []
+		#collecting finished chunks, and waiting for the oldest when too many are in flight
+		while self.pending and (len(self.pending) > self.max_pending or self.pending[0][1].ready()):
+			keys, result = self.pending.popleft()
+			self.cleaned.update(zip(keys, result.get()))
+
+	def close(self):
+		'''
+		Clean the remaining descriptions and shut the pool down.
+
+		return: dictionary of the cleaned descriptions by key, in the order
+		they were added
+		'''
+		self.submit()
+		self.max_pending = 0
+		self.submit()
+		if self.pool is not None:
+			self.pool.close()
+			self.pool.join()
+			self.pool = None
+		return self.cleaned
@@ -1,5 +1,4 @@
 import requests, json, os, sys, time, re
-from bs4 import BeautifulSoup
 from datetime import datetime
 from sqlalchemy import *
 import pandas as pd
@@ -9,6 +8,8 @@ from sklearn.cluster import KMeans
 import numpy as np
 from pyspark.mllib.recommendation import ALS
 from pyspark import SparkContext
+from description_cleaning import DescriptionCleaner
+from similarity import top_k_similar
 
 #defining StatusBar function
 def show_work_status(singleCount, totalCount, currentCount=0):
@@ -21,6 +22,101 @@ def show_work_status(singleCount, totalCount, currentCount=0):
 		print('\n')
 
 
+#columns of tbl_app_info with the numpy dtype of their buffers
+app_info_columns = [('steam_appid', object), ('name', object), ('type', object), ('currency', object), ('initial_price', float), ('release_date', object), ('score', float), ('recommendation', float), ('windows', float), ('mac', float), ('linux', float), ('success', bool), ('header_image', object)]
+
+#value of each column for apps whose details are missing
+app_info_defaults = {'windows': 0, 'mac': 0, 'linux': 0, 'success': True}
+
+def new_app_buffers(capacity, buffers=None):
+	#allocating a buffer per column, keeping the rows of old buffers if given
+	new_buffers = {}
+	for column, dtype in app_info_columns:
+		new_buffers[column] = np.full(capacity, app_info_defaults.get(column, np.nan), dtype=dtype)
+		if buffers is not None:
+			new_buffers[column][:len(buffers[column])] = buffers[column]
+	return new_buffers
+
+def read_app_details(path, capacity=1024, n_jobs=None, fast=False):
+	'''
+	Stream Steam's app details file line by line into one buffer per column
+	of tbl_app_info, without keeping the lines or a dictionary per field.
+	Buffers double in size when full, and the HTML descriptions are cleaned
+	in a process pool while the file is read, so peak memory is bounded by
+	the size of the output rather than the input.
+
+	args:
+		path: app details file, one {steam_appid: app_data} object per line
+		capacity: initial number of rows of the buffers
+		n_jobs: number of processes cleaning the HTML descriptions, all
+		cores by default
+		fast: clean the descriptions by stripping the tags instead of
+		parsing the HTML
+
+	return: tbl_app_info frame in file order, and a dictionary of the game
+	descriptions by steam_appid
+	'''
+	buffers = new_app_buffers(capacity)
+	total_size = os.path.getsize(path)
+	read_size = 0
+	i = 0
+	with DescriptionCleaner(n_jobs, fast=fast) as cleaner, open(path, 'rb') as f:
+		#for each game in the app_info file
+		for raw_string in f:
+			if not raw_string.strip():
+				continue
+			if i == len(buffers['steam_appid']):
+				buffers = new_app_buffers(2 * i, buffers)
+			steam_id,app_data = list(json.loads(raw_string).items())[0]
+			buffers['steam_appid'][i] = steam_id
+			#checking if app_data is empty
+			if app_data == {}:
+				buffers['success'][i] = False
+			else:
+				initial_price = app_data.get('price_overview',{}).get('initial')
+				currency = app_data.get('price_overview',{}).get('currency')
+				#setting free games to have an initial price of 0 so it is numerical
+				if app_data.get('is_free') == True:
+					initial_price = 0
+				app_name = app_data.get('name')
+				critic_score = app_data.get('metacritic', {}).get('score')
+				app_type = app_data.get('type')
+				#for each platform, it is checking if it is supported
+				#if it is, it sets the value for that platform to 1
+				for (platform, is_supported) in app_data.get('platforms').items():
+					if is_supported == True:
+						buffers[platform][i] = 1
+				#ignoring games that haven't released yet
+				if app_data.get('release_date',{}).get('coming_soon') == False:
+					#sending the HTML description to be cleaned while the file is read
+					cleaner.add(steam_id, app_data.get('about_the_game'))
+					release_date = app_data.get('release_date',{}).get('date')
+					#parsing different date formats
+					if not release_date == '':
+						if re.search(',', release_date) == None:
+							release_date = datetime.strptime(release_date, '%b %Y')
+						else:
+							try:
+								release_date = datetime.strptime(release_date, '%b %d, %Y')
+							except:
+								release_date = datetime.strptime(release_date, '%d %b, %Y')
+				recommendation = app_data.get('recommendations',{}).get('total')
+				header_image = app_data.get('header_image')
+				#writing the row into the buffers, missing numbers stay NaN
+				for column, value in [('initial_price', initial_price), ('currency', currency), ('name', app_name), ('score', critic_score), ('type', app_type), ('release_date', release_date), ('recommendation', recommendation), ('header_image', header_image)]:
+					if value is not None or buffers[column].dtype == object:
+						buffers[column][i] = value
+			i += 1
+			show_work_status(len(raw_string), total_size, read_size)
+			read_size += len(raw_string)
+		#collecting the last cleaned descriptions, in the order of the apps
+		dic_about_the_game = cleaner.close()
+
+	df_steam_app = pd.DataFrame({column: buffers[column][:i] for column, dtype in app_info_columns})
+	df_steam_app['initial_price'] = df_steam_app['initial_price'] / 100.0
+	return df_steam_app, dic_about_the_game
+
+
 # set file pathdata
 path_app_info = './/app_detail.txt'
 path_app_stats = './data/2017-08-14.json'
@@ -40,76 +136,8 @@ engine.execute('ALTER DATABASE game_recommendation CHARACTER SET = utf8mb4')
 with open(path_app_stats,'rb') as f:
 	dic_steamspy = json.load(f)
 
-#opening and loading the data from Steam's 
-with open(path_app_info, 'rb') as f:
-	#creating temporary dictionary with empty values for each key
-	dic_steam_app = {'initial_price':{},'name':{},'score':{},'windows':{},'mac':{},'linux':{},'type':{},'release_date':{},'recommendation':{},'header_image':{},'currency':{},'success':{}}
-	dic_about_the_game = {}
-	#readlines to create a list with each line as an element
-	lst_raw_string = f.readlines()
-	total_count = len(lst_raw_string)
-	current_count = 0
-	#for each game in the app_info file
-	for raw_string in lst_raw_string:
-		steam_id,app_data = list(json.loads(raw_string).items())[0]
-		#checking if app_data is empty
-		if app_data == {}:
-			dic_steam_app['success'].update({steam_id:False})
-		else:
-			initial_price = app_data.get('price_overview',{}).get('initial')
-			currency = app_data.get('price_overview',{}).get('currency')
-			#setting free games to have an initial price of 0 so it is numerical
-			if app_data.get('is_free') == True:
-				initial_price = 0
-			app_name = app_data.get('name')
-			critic_score = app_data.get('metacritic', {}).get('score')
-			app_type = app_data.get('type')
-			#for each platform, it is checking if it is supported
-			#if it is, it sets the value for that platform to 1
-			for (platform, is_supported) in app_data.get('platforms').items():
-				if is_supported == True:
-					dic_steam_app[platform].update({steam_id:1})
-			#ignoring games that haven't released yet
-			if app_data.get('release_date',{}).get('coming_soon') == False:
-				about_the_game = app_data.get('about_the_game')
-				#parsing HTML with BeautifulSoup
-				soup = BeautifulSoup(about_the_game,'lxml')
-				game_description = re.sub(r'(\s+)',' ',soup.text).strip()
-				dic_about_the_game.update({steam_id:game_description})
-				release_date = app_data.get('release_date',{}).get('date')
-				#parsing different date formats
-				if not release_date == '':
-					if re.search(',', release_date) == None:
-						release_date = datetime.strptime(release_date, '%b %Y')
-					else:
-						try:
-							release_date = datetime.strptime(release_date, '%b %d, %Y')
-						except:
-							release_date = datetime.strptime(release_date, '%d %b, %Y')
-			recommendation = app_data.get('recommendations',{}).get('total')
-			header_image = app_data.get('header_image')
-			#updating temporary dictionary with data
-			dic_steam_app['initial_price'].update({steam_id:initial_price})
-			dic_steam_app['currency'].update({steam_id:currency})
-			dic_steam_app['name'].update({steam_id:app_name})
-			dic_steam_app['score'].update({steam_id:critic_score})
-			dic_steam_app['type'].update({steam_id:app_type})
-			dic_steam_app['release_date'].update({steam_id:release_date})
-			dic_steam_app['recommendation'].update({steam_id:recommendation})
-			dic_steam_app['header_image'].update({steam_id:header_image})
-		show_work_status(1, total_count, current_count)
-		current_count += 1
-
-
-df_steam_app = pd.DataFrame(dic_steam_app)
-df_steam_app.initial_price = df_steam_app.initial_price.map(lambda x: x/100.0)
-df_steam_app.index.name = 'steam_appid'
-df_steam_app['windows'] = df_steam_app.windows.fillna(0)
-df_steam_app['mac'] = df_steam_app.mac.fillna(0)
-df_steam_app['linux'] = df_steam_app.linux.fillna(0)
-df_steam_app = df_steam_app[['name', 'type', 'currency', 'initial_price', 'release_date', 'score', 'recommendation', 'windows', 'mac', 'linux', 'success','header_image']]
-df_steam_app.reset_index(inplace=True)
-df_steam_app.success.fillna(True, inplace=True)
+#opening the data from Steam's app details and streaming it into tbl_app_info
+df_steam_app, dic_about_the_game = read_app_details(path_app_info)
 df_steam_app.to_sql('tbl_app_info',engine,if_exists='replace',index=False)
 
 
@@ -171,18 +199,18 @@ for i in list(set(dic_about_the_game.keys()) - set(df_valid_games.steam_appid)):
 # http://scikit-learn.org/stable/modules/generated/sklearn.feature_extraction.text.TfidfVectorizer.html
 tfidf = TfidfVectorizer(strip_accents='unicode',stop_words='english').fit_transform(list(dic_about_the_game.values()))
 lst_app_id = list(dic_about_the_game.keys())
-dic_recomended = {}
 total_count = len(lst_app_id)
 current_count = 0
-for index in range(tfidf.shape[0]):
-	cosine_similarities = linear_kernel(tfidf[index:index+1], tfidf).flatten()
-	related_docs_indices = cosine_similarities.argsort()[-2:-22:-1]
-	dic_recomended.update({lst_app_id[index]:[lst_app_id[i] for i in related_docs_indices]})
-	show_work_status(1,total_count,current_count)
-	current_count+=1
+def show_block_status(rows):
+	global current_count
+	show_work_status(rows,total_count,current_count)
+	current_count+=rows
+
+# picking the 20 most similar games of each game, the game itself excluded, a block of rows at a time
+related_docs_indices = top_k_similar(tfidf,k=20,on_block=show_block_status)
 
 # adding results to dataframe/SQL
-df_content_based_results = pd.DataFrame(dic_recomended).T
+df_content_based_results = pd.DataFrame(np.array(lst_app_id,dtype=object)[related_docs_indices],index=lst_app_id)
 df_content_based_results.index.name = 'steam_appid'
 df_content_based_results.reset_index(inplace=True)
 df_content_based_results.to_sql('tbl_results_content_based',engine,if_exists='replace')
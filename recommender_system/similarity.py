@@ -0,0 +1,60 @@
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+
+import numpy as np
+
+def top_k_block(matrix, transposed, start, stop, k):
+	'''
+	Top k neighbours of the rows start to stop of matrix, in the order of
+	argsort()[-2:-k-2:-1] on each row of linear_kernel(matrix, matrix): the
+	most similar row, normally the row itself, is skipped.
+	'''
+	similarities = matrix[start:stop] @ transposed
+	if hasattr(similarities, 'toarray'):
+		similarities = similarities.toarray()
+	n = similarities.shape[1]
+	m = min(k + 1, n)
+	rows = np.arange(similarities.shape[0])[:, None]
+	#selecting the m most similar columns of each row without sorting the whole row
+	top = np.argpartition(similarities, n - m, axis=1)[:, n - m:]
+	#ordering them from the most to the least similar
+	order = np.argsort(similarities[rows, top], axis=1, kind='stable')[:, ::-1]
+	return top[rows, order][:, 1:]
+
+def top_k_similar(matrix, k=20, block_size=None, n_jobs=None, on_block=None):
+	'''
+	Indices of the k most similar rows of each row of a matrix, eg. the
+	tfidf matrix of the game descriptions, by linear kernel.
+
+	The similarities are computed as sparse matrix products over blocks of
+	rows, so only one dense block per thread is held at a time, and the
+	blocks run on a thread pool.
+
+	args:
+		matrix: scipy sparse or numpy matrix with one row per item
+		k: number of neighbours per row
+		block_size: rows per block, by default as many as fit a dense block
+		of about 64 MB
+		n_jobs: number of threads, all cores by default
+		on_block: called with the number of rows of each finished block,
+		for progress reporting
+
+	return: int array of shape (rows, k) with the indices of the neighbours
+	of each row, from the most to the least similar
+	'''
+	n = matrix.shape[0]
+	if block_size is None:
+		block_size = max(1, 8 * 2**20 // max(n, 1))
+	if n_jobs is None:
+		n_jobs = cpu_count()
+	transposed = matrix.T.tocsr() if hasattr(matrix, 'tocsr') else matrix.T
+
+	result = np.empty((n, max(min(k + 1, n) - 1, 0)), dtype=np.int64)
+	starts = range(0, n, block_size)
+	with ThreadPoolExecutor(n_jobs) as executor:
+		blocks = executor.map(lambda start: top_k_block(matrix, transposed, start, min(start + block_size, n), k), starts)
+		for start, block in zip(starts, blocks):
+			result[start:start + len(block)] = block
+			if on_block is not None:
+				on_block(len(block))
+	return result